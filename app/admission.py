@@ -0,0 +1,222 @@
+import os
+import time
+import math
+import shutil
+import hashlib
+
+import redis
+
+from app.metrics import redis_client, QUEUE_NAME
+
+
+# =====================================================
+# CONFIG
+# =====================================================
+
+# Jobs waiting in the broker before new uploads are turned away
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", "100"))
+
+# Admitted but unfinished work, in pages x stages
+MAX_PENDING_WORK = int(os.getenv("MAX_PENDING_WORK", "5000"))
+
+MIN_FREE_DISK_MB = int(os.getenv("MIN_FREE_DISK_MB", "500"))
+
+OVERLOAD_RETRY_AFTER = int(os.getenv("OVERLOAD_RETRY_AFTER", "60"))
+
+# Per-client token bucket: burst size and sustained uploads per minute
+RATE_LIMIT_BURST = int(os.getenv("RATE_LIMIT_BURST", "10"))
+RATE_LIMIT_PER_MINUTE = float(os.getenv("RATE_LIMIT_PER_MINUTE", "10"))
+
+# Comma-separated keys that get their own bucket; any other client is
+# limited by address, so an invented X-API-Key buys nothing
+API_KEYS = {key.strip() for key in os.getenv("API_KEYS", "").split(",") if key.strip()}
+
+# Unreleased reservations expire, so a hard-killed job cannot hold its
+# work forever; the worker pushes the deadline out when the job starts
+ADMISSION_RESERVATION_TTL = int(os.getenv("ADMISSION_RESERVATION_TTL", "3600"))
+
+# analysis_id -> deadline, and analysis_id -> work units
+RESERVATIONS_KEY = "admission:reservations"
+RESERVATION_UNITS_KEY = "admission:reservation_units"
+
+DATA_DIR = "data"
+
+
+# =====================================================
+# TOKEN BUCKET
+# =====================================================
+
+# Atomic refill + take; returns {allowed, seconds until enough tokens}
+TOKEN_BUCKET_SCRIPT = redis_client.register_script("""
+local capacity = tonumber(ARGV[1])
+local rate = tonumber(ARGV[2])
+local now = tonumber(ARGV[3])
+local cost = tonumber(ARGV[4])
+
+local bucket = redis.call("HMGET", KEYS[1], "tokens", "ts")
+local tokens = tonumber(bucket[1]) or capacity
+local ts = tonumber(bucket[2]) or now
+
+tokens = math.min(capacity, tokens + math.max(0, now - ts) * rate)
+
+local allowed = 0
+local retry_after = 0
+
+if tokens >= cost then
+    tokens = tokens - cost
+    allowed = 1
+else
+    retry_after = (cost - tokens) / rate
+end
+
+redis.call("HSET", KEYS[1], "tokens", tokens, "ts", now)
+redis.call("EXPIRE", KEYS[1], math.ceil(capacity / rate) + 1)
+
+return {allowed, tostring(retry_after)}
+""")
+
+
+def rate_limit_client(api_key, address):
+    """Bucket name for a request: a configured API key, else the client address."""
+
+    if api_key and api_key in API_KEYS:
+        # Keys are not stored in Redis in the clear
+        return "key:" + hashlib.sha256(api_key.encode()).hexdigest()[:16]
+
+    return f"ip:{address or 'unknown'}"
+
+
+def check_rate_limit(client_id, cost=1):
+    """Seconds the client must wait, or None if the upload is allowed."""
+
+    try:
+        allowed, retry_after = TOKEN_BUCKET_SCRIPT(
+            keys=[f"ratelimit:{client_id}"],
+            args=[RATE_LIMIT_BURST, RATE_LIMIT_PER_MINUTE / 60, time.time(), cost]
+        )
+    except redis.RedisError as e:
+        # Fail open, the broker outage surfaces when the job is queued
+        print(f"Rate limit error: {e}")
+        return None
+
+    if allowed:
+        return None
+
+    return max(1, math.ceil(float(retry_after)))
+
+
+# =====================================================
+# CAPACITY
+# =====================================================
+
+def check_storage():
+    """Seconds to wait for disk space, or None if there is room for uploads."""
+
+    os.makedirs(DATA_DIR, exist_ok=True)
+
+    free_mb = shutil.disk_usage(DATA_DIR).free // (1024 * 1024)
+
+    if free_mb < MIN_FREE_DISK_MB:
+        return OVERLOAD_RETRY_AFTER
+
+    return None
+
+
+# Drops reservations past their deadline, leaves the live backlog in "backlog"
+PRUNE_RESERVATIONS = """
+local expired = redis.call("ZRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+
+if #expired > 0 then
+    redis.call("ZREMRANGEBYSCORE", KEYS[1], "-inf", ARGV[1])
+    redis.call("HDEL", KEYS[2], unpack(expired))
+end
+
+local backlog = 0
+
+for _, units in ipairs(redis.call("HVALS", KEYS[2])) do
+    backlog = backlog + tonumber(units)
+end
+"""
+
+PENDING_WORK_SCRIPT = redis_client.register_script(PRUNE_RESERVATIONS + """
+return backlog
+""")
+
+# Atomic check + reserve, so concurrent uploads cannot all pass the check
+# before any of them is counted; returns 1 if admitted
+ADMIT_WORK_SCRIPT = redis_client.register_script(PRUNE_RESERVATIONS + """
+local units = tonumber(ARGV[4])
+
+if redis.call("LLEN", KEYS[3]) >= tonumber(ARGV[6]) then
+    return 0
+end
+
+-- An oversized job is still admitted into an idle system
+if backlog > 0 and backlog + units > tonumber(ARGV[5]) then
+    return 0
+end
+
+redis.call("ZADD", KEYS[1], ARGV[2], ARGV[3])
+redis.call("HSET", KEYS[2], ARGV[3], units)
+
+return 1
+""")
+
+
+def pending_work():
+    """Work units of live reservations, pruning expired ones."""
+
+    return int(PENDING_WORK_SCRIPT(
+        keys=[RESERVATIONS_KEY, RESERVATION_UNITS_KEY],
+        args=[time.time()]
+    ))
+
+
+def admit_work(analysis_id, work_units):
+    """
+    Reserve capacity for a job. Seconds to wait if the queue or the
+    admitted backlog is full, or None once the work is reserved.
+    """
+
+    now = time.time()
+
+    try:
+        admitted = ADMIT_WORK_SCRIPT(
+            keys=[RESERVATIONS_KEY, RESERVATION_UNITS_KEY, QUEUE_NAME],
+            args=[
+                now,
+                now + ADMISSION_RESERVATION_TTL,
+                analysis_id,
+                work_units,
+                MAX_PENDING_WORK,
+                MAX_QUEUE_DEPTH
+            ]
+        )
+    except redis.RedisError as e:
+        print(f"Capacity check error: {e}")
+        return None
+
+    if admitted:
+        return None
+
+    return OVERLOAD_RETRY_AFTER
+
+
+def extend_reservation(analysis_id, seconds):
+    """Move a live reservation's deadline to now + seconds."""
+
+    try:
+        redis_client.zadd(RESERVATIONS_KEY, {analysis_id: time.time() + seconds}, xx=True)
+    except redis.RedisError as e:
+        print(f"Extend reservation error: {e}")
+
+
+def release_work(analysis_id):
+
+    try:
+        pipe = redis_client.pipeline()
+        pipe.zrem(RESERVATIONS_KEY, analysis_id)
+        pipe.hdel(RESERVATION_UNITS_KEY, analysis_id)
+        pipe.execute()
+    except redis.RedisError as e:
+        print(f"Release work error: {e}")
@@ -1,14 +1,16 @@
 import os
 from dotenv import load_dotenv
-from crewai import Agent, LLM
+from crewai import Agent
 
 from app.tools import read_data_tool, investment_tool, risk_tool
+from app.replay import ReplayLLM
 
 load_dotenv()
 
 # ✅ NVIDIA GLM-4.7 LLM
 
-llm = LLM(
+# Record/replay-aware LLM, see app/replay.py (LLM_REPLAY_MODE, off by default)
+llm = ReplayLLM(
     model="meta/llama3-8b-instruct",
     base_url="https://integrate.api.nvidia.com/v1",
     api_key=os.getenv("NVIDIA_API_KEY"),
@@ -112,7 +114,7 @@ risk_assessor = Agent(
 
     goal=(
         "Analyze financial document risks using tool output and produce structured risk report. "
-        "You MUST use the read_data_tool and MUST produce FINAL structured risk report. "
+        "You MUST use the risk_assessment_tool and MUST produce FINAL structured risk report. "
         "You MUST NOT stop after tool execution."
     ),
 
@@ -125,11 +127,39 @@ risk_assessor = Agent(
     memory=False,
 
     # ✅ FIXED
-    tools=[read_data_tool, risk_tool],
+    tools=[risk_tool],
 
     llm=llm,
     allow_delegation=False,
     respect_context_window=True,
     max_iter=2,
     max_execution_time=60,
-)
\ No newline at end of file
+)
+
+# ✅ Comparative Analyst
+comparative_analyst = Agent(
+    role="Comparative Financial Analyst",
+
+    goal=(
+        "Compare several financial filings using the extracted metrics table. "
+        "Explain period-over-period changes for the same company, or relative position "
+        "between peer companies, based strictly on the figures provided."
+    ),
+
+    backstory=(
+        "You are an equity research analyst who builds quarterly and peer comparison models. "
+        "You read metric tables carefully, call out missing data instead of guessing, "
+        "and focus on the few changes that matter most to investors."
+    ),
+
+    verbose=True,
+    memory=False,
+
+    tools=[],
+
+    llm=llm,
+    allow_delegation=False,
+    respect_context_window=True,
+    max_iter=1,
+    max_execution_time=60,
+)
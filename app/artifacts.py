@@ -0,0 +1,527 @@
+import os
+import re
+import json
+import mmap
+import hashlib
+import shutil
+import tempfile
+from datetime import datetime
+
+from pypdf import PdfReader
+
+from app.indicators import FINANCIAL_KEYWORDS
+
+
+# =====================================================
+# CONFIG
+# =====================================================
+
+# Shared data volume, so API and workers see the same artifacts
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "data/artifacts")
+
+# Bump when extraction changes; older artifacts are rebuilt on next use
+ARTIFACT_VERSION = 6
+
+SECTION_PATTERNS = {
+    "highlights": r"highlights",
+    "financial_summary": r"financial summary",
+    "operational_summary": r"operational summary",
+    "income_statement": r"(income statement|statements? of operations)",
+    "balance_sheet": r"(balance sheet|statements? of financial position)",
+    "cash_flow_statement": r"statements? of cash flows",
+    "outlook": r"outlook",
+    "risk_factors": r"risk factors",
+    "md_and_a": r"management'?s discussion",
+}
+
+METRIC_PATTERNS = {
+    "revenue": r"total revenues?",
+    "net_income": r"net (income|loss)",
+    "operating_income": r"(income from operations|operating income)",
+    "operating_cash_flow": r"(net cash provided by operating activities|operating cash flow)",
+    "free_cash_flow": r"free cash flow",
+    "cash_and_equivalents": r"cash,? (and )?cash equivalents",
+    "total_debt": r"total debt",
+    "gross_margin": r"gross margin",
+    "operating_margin": r"operating margin",
+}
+
+# Reported as percentages; every other metric is an amount
+PERCENT_METRICS = {"gross_margin", "operating_margin"}
+
+# Q2 2025, Q2-2025, Q2'25, 2Q25, Q2 FY2025
+QUARTER_RE = re.compile(r"\b(?:Q([1-4])|([1-4])Q)[\s'\-]*(?:FY)?[\s'\-]*(\d{4}|\d{2})\b", re.IGNORECASE)
+FISCAL_YEAR_RE = re.compile(r"\b(?:FY[\s'\-]*(\d{4}|\d{2})|fiscal (?:year )?(\d{4}))\b", re.IGNORECASE)
+
+# A figure standing on its own: 25,500  (1,234)  -12%  $ 146  or a "-" empty cell.
+# Figures glued to units (22.5B) or words are not table cells and are skipped.
+NUMBER_TOKEN_RE = re.compile(
+    r"(?<![\w.])(\(?-?(?:\$\s?)?\d[\d,]*(?:\.\d+)?\)?%?)(?![\w.%])"
+    r"|(?<!\S)(-)(?!\S)"
+)
+
+YEAR_RE = re.compile(r"^(19|20)\d{2}$")
+
+# Footnote markers glued to a label: "Total revenues(1)", "(GAAP)(2)", "Net income*"
+FOOTNOTE_RE = re.compile(r"(?<=[A-Za-z)\]])(?:\(\d{1,2}\)|\[\d{1,2}\]|\*+)")
+
+SECTION_RES = {
+    name: re.compile(rf"^\s*{pattern}\b", re.IGNORECASE | re.MULTILINE)
+    for name, pattern in SECTION_PATTERNS.items()
+}
+
+# Labels may be qualified ("GAAP net income", "Total GAAP gross margin")
+METRIC_RES = {
+    name: re.compile(rf"\b{pattern}\b", re.IGNORECASE)
+    for name, pattern in METRIC_PATTERNS.items()
+}
+
+
+# =====================================================
+# EXTRACTION
+# =====================================================
+
+def clean_page_text(text):
+
+    text = text.replace("\x00", "")
+
+    text = re.sub(r"\n{3,}", "\n\n", text)
+
+    text = re.sub(r"[^\x00-\x7F]+", " ", text)
+
+    return text.strip()
+
+
+def parse_value(raw):
+
+    value = raw.replace("$", "").replace(",", "").replace(" ", "").strip()
+
+    negative = value.startswith("(") or value.startswith("-")
+
+    value = value.strip("()-%")
+
+    try:
+        number = float(value)
+    except ValueError:
+        return None
+
+    return -number if negative else number
+
+
+def parse_metric_value(name, raw, label=""):
+    """Value of a figure for a metric, or None if the figure has the wrong kind."""
+
+    if raw == "-":
+        return None
+
+    # A YoY change is not revenue, and a bare amount is not a margin
+    if raw.endswith("%") != (name in PERCENT_METRICS):
+        return None
+
+    value = parse_value(raw)
+
+    # "Net loss of 312" is negative income
+    if value is not None and "loss" in label.lower():
+        value = -abs(value)
+
+    return value
+
+
+def number_tokens(text):
+    return [amount or empty for amount, empty in NUMBER_TOKEN_RE.findall(text)]
+
+
+def period_key(period):
+    return (period["year"], period["quarter"] or 0)
+
+
+def target_column(columns, period):
+    """Column of the document's own period, else the most recent one."""
+
+    if period:
+        for index, column in enumerate(columns):
+            if period_key(column) == period_key(period):
+                return index
+
+    return max(range(len(columns)), key=lambda index: period_key(columns[index]))
+
+
+def page_lines(text):
+    """
+    ``(line, columns)`` for each line of a page. A line naming two or more
+    periods is a column header and opens a table; ``columns`` are the
+    periods of the active header, or None outside a table.
+    """
+
+    columns = None
+
+    for line in text.splitlines():
+
+        # A marker would otherwise be read as the first column
+        line = FOOTNOTE_RE.sub("", line)
+
+        mentions = period_mentions(line)
+
+        if len(mentions) >= 2:
+            columns = mentions
+            continue
+
+        yield line, columns
+
+
+def label_match(pattern, line):
+    """Label on a row, only if it comes before the row's figures."""
+
+    match = pattern.search(line)
+
+    if match is None or number_tokens(line[:match.start()]):
+        return None
+
+    return match
+
+
+def extract_table_metrics(pages, period):
+    """
+    Metrics from summary tables. Rows under a column header are read
+    positionally against it and the column of the reporting period is taken.
+    """
+
+    metrics = {}
+
+    for page_number, text in enumerate(pages):
+        for line, columns in page_lines(text):
+
+            if columns is None:
+                continue
+
+            for name, pattern in METRIC_RES.items():
+
+                if name in metrics:
+                    continue
+
+                match = label_match(pattern, line)
+
+                if not match:
+                    continue
+
+                tokens = number_tokens(line[match.end():])
+
+                if len(tokens) < len(columns):
+                    continue
+
+                index = target_column(columns, period)
+                value = parse_metric_value(name, tokens[index], match.group(0))
+
+                if value is not None:
+                    metrics[name] = {
+                        "value": value,
+                        "raw": tokens[index],
+                        "page": page_number,
+                        "period": columns[index]["label"],
+                        "source": "table"
+                    }
+
+    return metrics
+
+
+def extract_prose_metrics(pages, skip):
+    """
+    First figure of the right kind after a metric mentioned in running text.
+    Lines inside a table are left alone: their first figure is the oldest
+    column, not the reporting period.
+    """
+
+    metrics = {}
+
+    for page_number, text in enumerate(pages):
+        for line, columns in page_lines(text):
+
+            if columns is not None:
+                continue
+
+            for name, pattern in METRIC_RES.items():
+
+                if name in skip or name in metrics:
+                    continue
+
+                match = pattern.search(line)
+
+                if not match:
+                    continue
+
+                raw = next(
+                    (
+                        token for token in number_tokens(line[match.end():])
+                        if not YEAR_RE.match(token)
+                        and parse_metric_value(name, token) is not None
+                    ),
+                    None
+                )
+
+                if raw is not None:
+                    metrics[name] = {
+                        "value": parse_metric_value(name, raw, match.group(0)),
+                        "raw": raw,
+                        "page": page_number,
+                        "period": None,
+                        "source": "prose"
+                    }
+
+    return metrics
+
+
+def extract_metrics(pages, period=None):
+    """
+    Labelled figures per metric with the page they were found on. Table
+    values for the reporting period win over figures quoted in prose.
+    """
+
+    metrics = extract_table_metrics(pages, period)
+
+    metrics.update(extract_prose_metrics(pages, skip=metrics))
+
+    return metrics
+
+
+def detect_sections(pages):
+
+    sections = []
+
+    for page_number, text in enumerate(pages):
+        for name, pattern in SECTION_RES.items():
+            if pattern.search(text):
+                sections.append({"name": name, "page": page_number})
+
+    return sections
+
+
+def period_from_match(match):
+
+    if match.re is QUARTER_RE:
+        quarter = int(match.group(1) or match.group(2))
+        year = int(match.group(3))
+    else:
+        quarter = None
+        year = int(match.group(1) or match.group(2))
+
+    year = year + 2000 if year < 100 else year
+
+    label = f"Q{quarter} {year}" if quarter else f"FY {year}"
+
+    return {"label": label, "year": year, "quarter": quarter}
+
+
+def period_mentions(line):
+    """Periods named on a line, in order; "Q2 FY2025" counts once."""
+
+    found = [(match.start(), match.end(), match) for match in QUARTER_RE.finditer(line)]
+
+    for match in FISCAL_YEAR_RE.finditer(line):
+        if not any(start <= match.start() < end for start, end, _ in found):
+            found.append((match.start(), match.end(), match))
+
+    return [period_from_match(match) for _, _, match in sorted(found, key=lambda item: item[0])]
+
+
+def detect_period(text):
+    """
+    Reporting period from the first page, e.g. Q2 2025 or FY 2024: the first
+    line naming a single period (a title), else the latest period named in
+    a table header.
+    """
+
+    header_periods = []
+
+    for line in text.splitlines():
+
+        mentions = period_mentions(line)
+
+        if len(mentions) == 1:
+            return mentions[0]
+
+        header_periods.extend(mentions)
+
+    if header_periods:
+        return max(header_periods, key=period_key)
+
+    return None
+
+
+def indicator_hits(text):
+
+    text = text.lower()
+
+    hits = {keyword: text.count(keyword) for keyword in FINANCIAL_KEYWORDS}
+
+    return {keyword: count for keyword, count in hits.items() if count}
+
+
+# =====================================================
+# STORE
+# =====================================================
+
+def file_hash(file_path):
+
+    digest = hashlib.sha256()
+
+    with open(file_path, "rb") as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b""):
+            digest.update(chunk)
+
+    return digest.hexdigest()
+
+
+def artifact_path(document_hash):
+    return os.path.join(ARTIFACT_DIR, document_hash[:2], document_hash)
+
+
+def load_artifact(document_hash):
+
+    index_path = os.path.join(artifact_path(document_hash), "index.json")
+
+    if not os.path.exists(index_path):
+        return None
+
+    with open(index_path) as f:
+        index = json.load(f)
+
+    if index.get("version") != ARTIFACT_VERSION:
+        return None
+
+    return index
+
+
+def build_artifact(file_path, document_hash):
+    """
+    Parse a PDF once into a per-document artifact directory:
+
+    text.txt   — cleaned text of all non-empty pages joined by newlines
+                 (ASCII only, so byte offsets equal character offsets)
+    index.json — page offsets into text.txt, detected sections,
+                 extracted metrics, indicator keyword counts, reporting
+                 period and PDF title/subject/keywords
+    """
+
+    reader = PdfReader(file_path)
+
+    pages = []
+
+    for page in reader.pages:
+        try:
+            text = page.extract_text()
+        except Exception:
+            text = ""
+        pages.append(clean_page_text(text) if text else "")
+
+    # Kept for the pre-classifier, which runs on the artifact
+    info = reader.metadata or {}
+
+    metadata = {
+        key: str(info.get(f"/{key.title()}") or "")
+        for key in ("title", "subject", "keywords")
+    }
+
+    # Same layout the read tool has always returned: non-empty pages, "\n" joined
+    page_offsets = []
+    text_parts = []
+    position = 0
+
+    for text in pages:
+
+        if not text:
+            page_offsets.append([position, position])
+            continue
+
+        if text_parts:
+            position += 1
+
+        page_offsets.append([position, position + len(text)])
+        text_parts.append(text)
+        position += len(text)
+
+    full_text = "\n".join(text_parts)
+
+    period = detect_period(text_parts[0] if text_parts else "")
+
+    index = {
+        "version": ARTIFACT_VERSION,
+        "hash": document_hash,
+        "pages": len(pages),
+        "chars": len(full_text),
+        "page_offsets": page_offsets,
+        "sections": detect_sections(pages),
+        "metrics": extract_metrics(pages, period),
+        "indicator_hits": indicator_hits(full_text),
+        "period": period,
+        "metadata": metadata,
+        "created_at": datetime.utcnow().isoformat()
+    }
+
+    target = artifact_path(document_hash)
+
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+
+    # Write to a temp dir and rename, so readers never see a partial artifact
+    staging = tempfile.mkdtemp(dir=os.path.dirname(target))
+
+    with open(os.path.join(staging, "text.txt"), "w", encoding="ascii") as f:
+        f.write(full_text)
+
+    with open(os.path.join(staging, "index.json"), "w") as f:
+        json.dump(index, f)
+
+    if os.path.exists(target):
+        shutil.rmtree(target, ignore_errors=True)
+
+    try:
+        os.rename(staging, target)
+    except OSError:
+        # Another worker published the same document first
+        shutil.rmtree(staging, ignore_errors=True)
+
+    return index
+
+
+def get_artifact(file_path):
+    """Artifact for a PDF, parsing it only if this content was never seen."""
+
+    document_hash = file_hash(file_path)
+
+    index = load_artifact(document_hash)
+
+    if index is None:
+        index = build_artifact(file_path, document_hash)
+
+    return index
+
+
+def read_text(index, page=None):
+    """Whole document text, or one page, memory-mapped from text.txt."""
+
+    if index["chars"] == 0:
+        return ""
+
+    with open(os.path.join(artifact_path(index["hash"]), "text.txt"), "rb") as f:
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+
+            if page is None:
+                return mm[:].decode("ascii")
+
+            start, end = index["page_offsets"][page]
+
+            return mm[start:end].decode("ascii")
+
+
+def iter_artifacts():
+    """Indexes of every stored document, for fleet-wide analytics."""
+
+    if not os.path.isdir(ARTIFACT_DIR):
+        return
+
+    for prefix in sorted(os.listdir(ARTIFACT_DIR)):
+        for document_hash in sorted(os.listdir(os.path.join(ARTIFACT_DIR, prefix))):
+
+            index = load_artifact(document_hash)
+
+            if index is not None:
+                yield index
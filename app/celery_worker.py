@@ -1,10 +1,24 @@
 import os
 import traceback
 
-from celery import Celery
-from app.database import SessionLocal
-from app.models import AnalysisResult
-from app.crew_runner import run_crew
+import redis
+from celery import Celery, Task
+from celery.signals import worker_ready
+from celery.worker.request import Request
+from app.database import SessionLocal, engine
+from app.models import AnalysisResult, init_schema
+from app.crew_runner import run_crew, run_comparison, STAGES
+from app.storage import store_section, clear_sections, join_sections, prune_stage_cache
+from app.events import publish_event
+from app.metrics import redis_client
+from app.admission import release_work, extend_reservation
+from app.replay import transcript_session
+from app.profiling import JobProfiler, should_profile, PROFILE_SAMPLE_MEMORY
+from app.classifier import classify_document, format_classification
+
+
+# Workers may start before the API, bring the schema up to date here too
+init_schema(engine)
 
 
 celery = Celery(
@@ -14,29 +28,271 @@ celery = Celery(
 )
 
 
-@celery.task(bind=True)
-def analyze_document_task(self, analysis_id, query, file_path, file_name):
+# =====================================================
+# WORKER CAPACITY
+# =====================================================
+
+# Worst case a job runs every stage up to its agent's max_execution_time,
+# plus PDF parsing and DB writes
+PIPELINE_TIME_LIMIT = sum(stage["agent"].max_execution_time for stage in STAGES)
+
+TASK_SOFT_TIME_LIMIT = int(os.getenv("TASK_SOFT_TIME_LIMIT", PIPELINE_TIME_LIMIT + 60))
+TASK_TIME_LIMIT = int(os.getenv("TASK_TIME_LIMIT", TASK_SOFT_TIME_LIMIT + 30))
+
+# Time past the hard limit before a killed job's admitted work expires
+RESERVATION_MARGIN = 60
+
+# Late acks redeliver a job whose worker died; a job that keeps killing its
+# worker (OOM, segfault in a parser) is failed after this many deliveries
+TASK_MAX_DELIVERIES = int(os.getenv("TASK_MAX_DELIVERIES", "3"))
+
+celery.conf.update(
+    # Long jobs: reserve one task at a time so idle workers can take the rest
+    worker_prefetch_multiplier=1,
+
+    # Ack after completion, redeliver if the worker process dies mid-job
+    task_acks_late=True,
+    task_reject_on_worker_lost=True,
+
+    task_soft_time_limit=TASK_SOFT_TIME_LIMIT,
+    task_time_limit=TASK_TIME_LIMIT,
+
+    # Unacked tasks are redelivered after this, keep it above the hard limit
+    broker_transport_options={"visibility_timeout": TASK_TIME_LIMIT * 2},
+
+    # Recycle pool processes that grow past this many KiB (pypdf, CrewAI state)
+    worker_max_memory_per_child=int(os.getenv("WORKER_MAX_MEMORY_PER_CHILD", "1024000")),
+    worker_max_tasks_per_child=int(os.getenv("WORKER_MAX_TASKS_PER_CHILD", "50")),
+)
+
+if os.getenv("WORKER_CONCURRENCY"):
+    celery.conf.worker_concurrency = int(os.getenv("WORKER_CONCURRENCY"))
+
+
+# =====================================================
+# FAILED JOBS
+# =====================================================
+
+def remove_files(file_paths):
+
+    for file_path in file_paths:
+        try:
+            if os.path.exists(file_path):
+                os.remove(file_path)
+                print(f"Deleted file: {file_path}")
+        except Exception as cleanup_error:
+            print(f"Cleanup error: {cleanup_error}")
+
+
+def fail_job(analysis_id, message, file_paths):
+    """
+    Mark a job failed and clean up after it when its task could not: the
+    pool killed it or it was delivered too often. Safe to call repeatedly.
+    """
 
     db = SessionLocal()
 
+    try:
+        record = db.query(AnalysisResult).filter(
+            AnalysisResult.id == analysis_id
+        ).first()
+
+        if record and record.status == "processing":
+            record.status = "failed"
+            record.result = message
+            db.commit()
+
+            publish_event(analysis_id, status="failed", message=message)
+
+    except Exception as e:
+        print(f"Fail job error: {e}")
+
+    finally:
+        db.close()
+
+    release_work(analysis_id)
+
+    remove_files(file_paths)
+
+
+def job_files(kwargs):
+    """Uploads of a task call, analyze or compare."""
+
+    if kwargs.get("file_paths"):
+        return kwargs["file_paths"]
+
+    return [kwargs["file_path"]] if kwargs.get("file_path") else []
+
+
+def over_delivery_limit(analysis_id):
+    """Count this delivery; True once the job exceeded TASK_MAX_DELIVERIES."""
+
+    key = f"deliveries:{analysis_id}"
+
+    try:
+        pipe = redis_client.pipeline()
+        pipe.incr(key)
+        pipe.expire(key, 24 * 3600)
+        deliveries, _ = pipe.execute()
+    except redis.RedisError as e:
+        print(f"Delivery count error: {e}")
+        return False
+
+    return deliveries > TASK_MAX_DELIVERIES
+
+
+class JobRequest(Request):
+    """Runs in the main worker process, which outlives a killed pool child."""
+
+    def on_timeout(self, soft, timeout):
+
+        super().on_timeout(soft, timeout)
+
+        # The child got no chance to run its except/finally blocks
+        if not soft:
+            fail_job(
+                self.kwargs.get("analysis_id"),
+                f"Job exceeded the {timeout}s time limit",
+                job_files(self.kwargs)
+            )
+
+
+class JobTask(Task):
+    Request = JobRequest
+
+
+@worker_ready.connect
+def prune_caches(**kwargs):
+    """Drop expired stage cache entries once per worker start."""
+
+    db = SessionLocal()
+
+    try:
+        print(f"Pruned {prune_stage_cache(db)} expired stage cache entries")
+    except Exception as e:
+        print(f"Stage cache prune error: {e}")
+    finally:
+        db.close()
+
+
+def stage_recorder(db, record, analysis_id, sections):
+    """on_stage callback that stores, commits and publishes each stage."""
+
+    def on_stage(section):
+
+        # Commit each stage as it finishes so /result shows partial output
+        position = len(sections)
+        sections.append(section)
+
+        if record:
+            store_section(db, analysis_id, position, section["stage"], section["content"])
+            record.stages_completed += 1
+            db.commit()
+
+            publish_event(
+                analysis_id,
+                status="processing",
+                stage=section["stage"],
+                stages_completed=record.stages_completed,
+                content=section["content"]
+            )
+
+    return on_stage
+
+
+@celery.task(bind=True, base=JobTask)
+def analyze_document_task(self, analysis_id, query, file_path, file_name, classification=None, profile=False):
+
+    if over_delivery_limit(analysis_id):
+        message = f"Job failed: worker lost {TASK_MAX_DELIVERIES} times while processing it"
+        fail_job(analysis_id, message, [file_path])
+        return message
+
+    db = SessionLocal()
+
+    # Opt-in per job, or a random sample of jobs (PROFILE_SAMPLE_RATE)
+    profiler = None
+
+    if should_profile(profile):
+        profiler = JobProfiler(analysis_id, trace_memory=profile or PROFILE_SAMPLE_MEMORY).start()
+
     try:
 
         print(f"\n--- WORKER STARTED: {analysis_id} ---")
 
-        result = run_crew(
-            query=query,
-            file_path=file_path
-        )
+        # Hold the admitted work for as long as this run can take
+        extend_reservation(analysis_id, TASK_TIME_LIMIT + RESERVATION_MARGIN)
+
+        # Jobs queued without an upload-time classification get one here
+        if classification is None:
+            classification = classify_document(file_path)
+
+        if classification["label"] == "non_financial":
+
+            result = format_classification(classification)
+
+            record = db.query(AnalysisResult).filter(
+                AnalysisResult.id == analysis_id
+            ).first()
+
+            if record:
+                record.status = "rejected"
+                record.result = result
+                db.commit()
+
+                publish_event(analysis_id, status="rejected", message=result)
+
+            print(f"--- WORKER REJECTED: {analysis_id} ---\n")
+
+            return result
+
+        verify = classification["label"] != "financial"
 
         record = db.query(AnalysisResult).filter(
             AnalysisResult.id == analysis_id
         ).first()
 
+        sections = []
+
+        if not verify:
+            sections.append({
+                "stage": "pre_classification",
+                "content": format_classification(classification)
+            })
+
+        if record:
+            # Redelivered jobs start over, without the earlier attempt's output
+            record.stages_completed = 0
+            clear_sections(db, analysis_id)
+
+            for position, section in enumerate(sections):
+                store_section(db, analysis_id, position, section["stage"], section["content"])
+
+            db.commit()
+
+        with transcript_session(analysis_id, file_path=file_path, job="analyze", query=query, file_name=file_name, verify=verify):
+            run_crew(
+                query=query,
+                file_path=file_path,
+                verify=verify,
+                db=db,
+                on_stage=stage_recorder(db, record, analysis_id, sections)
+            )
+
+        result = join_sections(sections)
+
         if record:
+            # Result text lives in compressed, deduplicated sections
             record.status = "completed"
-            record.result = result
+            record.result = ""
             db.commit()
 
+            publish_event(
+                analysis_id,
+                status="completed",
+                stages_completed=record.stages_completed
+            )
+
         print(f"--- WORKER COMPLETED: {analysis_id} ---\n")
 
         return result
@@ -54,16 +310,111 @@ def analyze_document_task(self, analysis_id, query, file_path, file_name):
             record.result = str(e)
             db.commit()
 
+            publish_event(analysis_id, status="failed", message=str(e))
+
         raise e
 
     finally:
 
+        if profiler:
+            try:
+                path = profiler.save()
+
+                record = db.query(AnalysisResult).filter(
+                    AnalysisResult.id == analysis_id
+                ).first()
+
+                if record:
+                    record.profile_path = path
+                    db.commit()
+
+                print(f"Profile saved: {path}")
+            except Exception as profile_error:
+                print(f"Profile error: {profile_error}")
+
         db.close()
 
+        release_work(analysis_id)
+
         # ✅ DELETE FILE HERE (correct place)
-        try:
-            if os.path.exists(file_path):
-                os.remove(file_path)
-                print(f"Deleted file: {file_path}")
-        except Exception as cleanup_error:
-            print(f"Cleanup error: {cleanup_error}")
\ No newline at end of file
+        remove_files([file_path])
+
+
+@celery.task(bind=True, base=JobTask)
+def compare_documents_task(self, analysis_id, query, file_paths, file_names):
+
+    if over_delivery_limit(analysis_id):
+        message = f"Job failed: worker lost {TASK_MAX_DELIVERIES} times while processing it"
+        fail_job(analysis_id, message, file_paths)
+        return message
+
+    db = SessionLocal()
+
+    try:
+
+        print(f"\n--- COMPARISON STARTED: {analysis_id} ({len(file_paths)} documents) ---")
+
+        extend_reservation(analysis_id, TASK_TIME_LIMIT + RESERVATION_MARGIN)
+
+        record = db.query(AnalysisResult).filter(
+            AnalysisResult.id == analysis_id
+        ).first()
+
+        sections = []
+
+        if record:
+            # Redelivered jobs start over, without the earlier attempt's output
+            record.stages_completed = 0
+            clear_sections(db, analysis_id)
+            db.commit()
+
+        with transcript_session(analysis_id, file_paths=file_paths, job="compare", query=query, file_names=file_names):
+            run_comparison(
+                query=query,
+                file_paths=file_paths,
+                file_names=file_names,
+                db=db,
+                on_stage=stage_recorder(db, record, analysis_id, sections)
+            )
+
+        result = join_sections(sections)
+
+        if record:
+            record.status = "completed"
+            record.result = ""
+            db.commit()
+
+            publish_event(
+                analysis_id,
+                status="completed",
+                stages_completed=record.stages_completed
+            )
+
+        print(f"--- COMPARISON COMPLETED: {analysis_id} ---\n")
+
+        return result
+
+    except Exception as e:
+
+        traceback.print_exc()
+
+        record = db.query(AnalysisResult).filter(
+            AnalysisResult.id == analysis_id
+        ).first()
+
+        if record:
+            record.status = "failed"
+            record.result = str(e)
+            db.commit()
+
+            publish_event(analysis_id, status="failed", message=str(e))
+
+        raise e
+
+    finally:
+
+        db.close()
+
+        release_work(analysis_id)
+
+        remove_files(file_paths)
@@ -0,0 +1,127 @@
+import os
+import re
+
+from app.indicators import FINANCIAL_KEYWORDS
+from app.artifacts import get_artifact, read_text
+
+
+# =====================================================
+# CONFIG
+# =====================================================
+
+# Only the first pages are needed to tell a filing from anything else
+CLASSIFIER_MAX_PAGES = int(os.getenv("CLASSIFIER_MAX_PAGES", "5"))
+
+# Indicator hits per 1000 words
+FINANCIAL_DENSITY = float(os.getenv("CLASSIFIER_FINANCIAL_DENSITY", "8"))
+REJECT_DENSITY = float(os.getenv("CLASSIFIER_REJECT_DENSITY", "1"))
+
+# Share of word tokens that are figures (tables of numbers)
+FINANCIAL_NUMERIC_RATIO = 0.05
+REJECT_NUMERIC_RATIO = 0.02
+
+
+# =====================================================
+# KEYWORDS
+# =====================================================
+
+METADATA_HINTS = (
+    "10-k",
+    "10-q",
+    "annual report",
+    "quarterly report",
+    "earnings",
+    "financial",
+    "investor",
+    "shareholder",
+)
+
+WORD_RE = re.compile(r"[A-Za-z0-9$%.,()-]+")
+NUMBER_RE = re.compile(r"^\(?\$?-?\d[\d,]*(\.\d+)?%?\)?$")
+
+
+# =====================================================
+# CLASSIFIER
+# =====================================================
+
+def classify_document(file_path):
+    """
+    Cheap local check of whether a PDF is a financial report.
+
+    Returns a dict with ``label`` set to ``financial`` (LLM verification
+    can be skipped), ``non_financial`` (reject without running the crew)
+    or ``ambiguous`` (let the verifier agent decide).
+    """
+
+    # The artifact is parsed once per content hash and reused by the
+    # worker, so a re-upload is classified without touching the PDF
+    try:
+        artifact = get_artifact(file_path)
+    except Exception as e:
+        return {
+            "label": "non_financial",
+            "pages": 0,
+            "density": 0.0,
+            "numeric_ratio": 0.0,
+            "reason": f"Unreadable PDF: {str(e)}"
+        }
+
+    page_count = artifact["pages"]
+    metadata = artifact.get("metadata") or {}
+
+    text = "\n".join(
+        read_text(artifact, page)
+        for page in range(min(page_count, CLASSIFIER_MAX_PAGES))
+    ).lower()
+
+    words = WORD_RE.findall(text)
+
+    if not words:
+        # Scanned or image-only PDF, nothing to score on
+        return {
+            "label": "ambiguous",
+            "pages": page_count,
+            "density": 0.0,
+            "numeric_ratio": 0.0,
+            "reason": "No extractable text"
+        }
+
+    hits = sum(text.count(keyword) for keyword in FINANCIAL_KEYWORDS)
+    density = hits * 1000 / len(words)
+
+    numbers = sum(1 for word in words if NUMBER_RE.match(word))
+    numeric_ratio = numbers / len(words)
+
+    meta_text = " ".join(metadata.values()).lower()
+    metadata_hint = any(hint in meta_text for hint in METADATA_HINTS)
+
+    if density >= FINANCIAL_DENSITY and (numeric_ratio >= FINANCIAL_NUMERIC_RATIO or metadata_hint):
+        label = "financial"
+        reason = "High financial keyword density"
+    elif density < REJECT_DENSITY and numeric_ratio < REJECT_NUMERIC_RATIO and not metadata_hint:
+        label = "non_financial"
+        reason = "No financial indicators found"
+    else:
+        label = "ambiguous"
+        reason = "Mixed financial indicators"
+
+    return {
+        "label": label,
+        "pages": page_count,
+        "density": round(density, 2),
+        "numeric_ratio": round(numeric_ratio, 3),
+        "reason": reason
+    }
+
+
+def format_classification(classification):
+    """Report section that stands in for the skipped verification task."""
+
+    return (
+        "Document Pre-Classification Report:\n\n"
+        f"Classification: {classification['label']}\n"
+        f"Pages: {classification['pages']}\n"
+        f"Indicator Density: {classification['density']} per 1000 words\n"
+        f"Numeric Ratio: {classification['numeric_ratio']}\n"
+        f"Summary: {classification['reason']}"
+    )
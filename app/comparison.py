@@ -0,0 +1,110 @@
+import os
+from concurrent.futures import ThreadPoolExecutor
+
+import pandas as pd
+
+from app.artifacts import get_artifact, METRIC_PATTERNS
+
+
+# =====================================================
+# CONFIG
+# =====================================================
+
+# pypdf holds the GIL for most of a parse, but artifacts that already exist
+# are only a hash + JSON read, so threads keep the batch I/O-bound. Celery's
+# prefork children are daemonic and cannot start a process pool.
+EXTRACT_WORKERS = int(os.getenv("COMPARE_EXTRACT_WORKERS", "4"))
+
+MAX_COMPARE_DOCUMENTS = int(os.getenv("MAX_COMPARE_DOCUMENTS", "8"))
+
+
+# =====================================================
+# EXTRACTION
+# =====================================================
+
+def extract_artifacts(file_paths):
+    """Artifacts for every document of a batch, extracted in parallel."""
+
+    with ThreadPoolExecutor(max_workers=min(EXTRACT_WORKERS, len(file_paths))) as pool:
+        return list(pool.map(get_artifact, file_paths))
+
+
+# =====================================================
+# METRICS TABLE
+# =====================================================
+
+def relative_change(values, base):
+    """values / base - 1, or NaN where the base is not a positive finite number."""
+
+    base = base.where((base > 0) & (base < float("inf")))
+
+    return values / base - 1
+
+
+def build_metrics_table(artifacts, file_names):
+    """
+    One row per document, ordered by reporting period, with the raw metrics
+    plus period-over-period change (``_pop``) and position against the batch
+    median (``_vs_median``) computed column-wise.
+
+    ``_pop`` is only computed between consecutive documents with detected,
+    different periods, and ratios against a zero or negative base are left
+    empty rather than handed to the LLM as meaningless percentages.
+    """
+
+    rows = []
+
+    for position, (artifact, file_name) in enumerate(zip(artifacts, file_names)):
+
+        period = artifact.get("period") or {}
+
+        row = {
+            "document": f"{period.get('label', 'Unknown period')} ({file_name})",
+            "year": period.get("year"),
+            "quarter": period.get("quarter") or 0,
+            "position": position,
+        }
+
+        for metric in METRIC_PATTERNS:
+            value = artifact["metrics"].get(metric)
+            row[metric] = value["value"] if value else None
+
+        rows.append(row)
+
+    table = pd.DataFrame(rows)
+
+    # Documents without a detected period keep their upload order at the end
+    table = (
+        table.sort_values(["year", "quarter", "position"], na_position="last")
+        .set_index("document")
+    )
+
+    periods = table[["year", "quarter"]]
+
+    metrics = (
+        table.drop(columns=["year", "quarter", "position"])
+        .astype(float)
+        .dropna(axis=1, how="all")
+    )
+
+    dated = periods["year"].notna()
+
+    # Same period twice is a peer comparison, not a change over time
+    new_period = dated & dated.shift(1, fill_value=False) & (
+        periods.ne(periods.shift(1)).any(axis=1)
+    )
+
+    pop = relative_change(metrics, metrics.shift(1))
+    pop = pop.where(new_period, axis=0).add_suffix("_pop")
+
+    vs_median = relative_change(metrics, metrics.median()).add_suffix("_vs_median")
+
+    return pd.concat([metrics, pop, vs_median], axis=1)
+
+
+def render_metrics_table(table):
+
+    if table.empty or len(table.columns) == 0:
+        return "No metrics could be extracted from the documents."
+
+    return table.round(3).to_string(na_rep="n/a")
@@ -0,0 +1,123 @@
+import os
+import re
+
+
+# =====================================================
+# CONFIG
+# =====================================================
+
+# Rough prompt-token estimate, good enough for budgeting English prose
+CHARS_PER_TOKEN = 4
+
+DEFAULT_CONTEXT_BUDGET = int(os.getenv("CONTEXT_TOKEN_BUDGET", "400"))
+
+MARKDOWN_RE = re.compile(r"[*#_`]+")
+
+# "1. ", "2) ", "a. " before a heading
+NUMBERING_RE = re.compile(r"^(?:\d+[.)]\s*|[a-z][.)]\s+)", re.IGNORECASE)
+
+
+# =====================================================
+# SCHEMA
+# =====================================================
+
+def template_fields(expected_output):
+    """
+    Field names of a task's expected_output template, e.g.
+    ``["Revenue Analysis", "Profitability Analysis", ...]``.
+    The first line is the report title and is skipped.
+    """
+
+    lines = [line.strip() for line in expected_output.splitlines() if line.strip()]
+
+    return [
+        line[:-1].strip()
+        for line in lines[1:]
+        if line.endswith(":") and not line.startswith("-")
+    ]
+
+
+# =====================================================
+# COMPACTION
+# =====================================================
+
+def compact_output(text, fields):
+    """
+    Parse a stage output into ``{field: value}`` following its template.
+
+    Headings are matched case-insensitively and may carry markdown,
+    bullets or numbering, either as ``Field: text`` or as a line that is
+    just the field name (``### Cash Flow Analysis``). Text before the first
+    heading and unknown headings are dropped.
+    """
+
+    lookup = {field.lower(): field for field in fields}
+
+    summary = {}
+    current = None
+
+    for line in text.splitlines():
+
+        clean = MARKDOWN_RE.sub("", line).strip().lstrip("-").strip()
+
+        if not clean:
+            continue
+
+        name = NUMBERING_RE.sub("", clean)
+
+        heading, sep, rest = name.partition(":")
+
+        if sep and heading.strip().lower() in lookup:
+            current = lookup[heading.strip().lower()]
+            summary[current] = [rest.strip()] if rest.strip() else []
+            continue
+
+        if name.lower() in lookup:
+            current = lookup[name.lower()]
+            summary[current] = []
+            continue
+
+        if current is not None:
+            summary[current].append(clean)
+
+    return {
+        field: "; ".join(part for part in parts if part)
+        for field, parts in summary.items()
+        if any(parts)
+    }
+
+
+def truncate(text, max_chars):
+
+    if len(text) <= max_chars:
+        return text
+
+    return text[:max_chars].rsplit(" ", 1)[0] + "..."
+
+
+def render_context(text, fields, wanted, budget_tokens=DEFAULT_CONTEXT_BUDGET):
+    """
+    Compact upstream context for a downstream prompt: only the ``wanted``
+    template fields, each trimmed so the whole block fits ``budget_tokens``.
+    """
+
+    if not text:
+        return "Not available"
+
+    summary = compact_output(text, fields)
+
+    # Output did not follow the template, fall back to trimmed prose
+    if not summary:
+        return truncate(" ".join(text.split()), budget_tokens * CHARS_PER_TOKEN)
+
+    selected = [(field, summary[field]) for field in wanted if field in summary]
+
+    if not selected:
+        return "Not available"
+
+    per_field = budget_tokens * CHARS_PER_TOKEN // len(selected)
+
+    return "\n".join(
+        f"{field}: {truncate(value, max(per_field - len(field) - 2, 0))}"
+        for field, value in selected
+    )
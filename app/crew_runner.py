@@ -1,55 +1,326 @@
+import os
+import json
+import hashlib
+
 from crewai import Crew, Process
 
 from app.agents import (
     financial_analyst,
     verifier,
     investment_advisor,
-    risk_assessor
+    risk_assessor,
+    comparative_analyst
 )
 
 from app.task import (
+    PROMPT_VERSION,
     verification,
     analyze_financial_document,
     investment_analysis,
-    risk_assessment
+    risk_assessment,
+    comparative_analysis
 )
 
+from app.storage import load_stage, save_stage
+from app.artifacts import file_hash
+from app.context import template_fields, render_context
+from app.comparison import extract_artifacts, build_metrics_table, render_metrics_table
+from app.replay import active_transcript
+from app.tools import TOOL_ERRORS
+
+
+# =====================================================
+# STAGE GRAPH
+# =====================================================
+
+# Each stage lists what it actually reads, so its memo key only changes
+# when one of those inputs does. "context" maps a task placeholder to the
+# upstream stage and the template fields it needs from that stage's output.
+STAGES = [
+    {
+        "name": "verification",
+        "agent": verifier,
+        "task": verification,
+        "uses_document": True,
+        "uses_query": True,
+        "context": {},
+    },
+    {
+        "name": "financial_analysis",
+        "agent": financial_analyst,
+        "task": analyze_financial_document,
+        "uses_document": True,
+        "uses_query": True,
+        "context": {
+            "verification_summary": ("verification", [
+                "Company Name",
+                "Document Type",
+                "Reporting Period",
+            ]),
+        },
+        "context_budget": int(os.getenv("ANALYSIS_CONTEXT_BUDGET", "150")),
+    },
+    {
+        "name": "investment_analysis",
+        "agent": investment_advisor,
+        "task": investment_analysis,
+        "uses_document": False,
+        "uses_query": False,
+        "context": {
+            "analysis_summary": ("financial_analysis", [
+                "Revenue Analysis",
+                "Profitability Analysis",
+                "Growth Trends",
+                "Financial Strength",
+                "Key Insights",
+            ]),
+        },
+        "context_budget": int(os.getenv("INVESTMENT_CONTEXT_BUDGET", "400")),
+    },
+    {
+        "name": "risk_assessment",
+        "agent": risk_assessor,
+        "task": risk_assessment,
+        "uses_document": False,
+        "uses_query": False,
+        "context": {
+            "analysis_summary": ("financial_analysis", [
+                "Revenue Analysis",
+                "Cash Flow Analysis",
+                "Debt Analysis",
+                "Growth Trends",
+                "Financial Strength",
+            ]),
+        },
+        "context_budget": int(os.getenv("RISK_CONTEXT_BUDGET", "400")),
+    },
+]
+
+STAGES_BY_NAME = {stage["name"]: stage for stage in STAGES}
+
+# Comparison mode: a single LLM stage over the batch's metrics table
+COMPARISON_STAGE = {
+    "name": "comparative_analysis",
+    "agent": comparative_analyst,
+    "task": comparative_analysis,
+    "uses_document": True,
+    "uses_query": True,
+    "context": {},
+}
+
+
+def _prompt_fingerprint(stage):
+
+    task = stage["task"]
+    agent = stage["agent"]
+
+    parts = [
+        PROMPT_VERSION,
+        task.description,
+        task.expected_output,
+        agent.role,
+        agent.goal,
+        agent.backstory,
+        str(agent.llm.model),
+        ",".join(tool.name for tool in agent.tools),
+        json.dumps(stage["context"], sort_keys=True),
+        str(stage.get("context_budget")),
+    ]
+
+    return hashlib.sha256("\x1f".join(parts).encode()).hexdigest()
+
+
+# Computed at import, before kickoff interpolates the task templates
+for _stage in STAGES + [COMPARISON_STAGE]:
+    _stage["prompt"] = _prompt_fingerprint(_stage)
+    _stage["fields"] = template_fields(_stage["task"].expected_output)
+
+for _stage in STAGES:
+    for _upstream, _wanted in _stage["context"].values():
+        _missing = set(_wanted) - set(STAGES_BY_NAME[_upstream]["fields"])
+        if _missing:
+            raise ValueError(f"{_stage['name']} needs unknown {_upstream} fields: {_missing}")
+
+
+def stage_context(stage, outputs):
+    """Compact upstream summaries for a stage's prompt placeholders."""
+
+    return {
+        placeholder: render_context(
+            outputs.get(upstream),
+            STAGES_BY_NAME[upstream]["fields"],
+            wanted,
+            stage["context_budget"]
+        )
+        for placeholder, (upstream, wanted) in stage["context"].items()
+    }
 
-def run_crew(query, file_path):
-
-    financial_crew = Crew(
-        agents=[
-            verifier,
-            financial_analyst,
-            investment_advisor,
-            risk_assessor
-        ],
-        tasks=[
-            verification,
-            analyze_financial_document,
-            investment_analysis,
-            risk_assessment
-        ],
+
+def stage_key(stage, document_hash, query, context):
+
+    inputs = {
+        "stage": stage["name"],
+        "prompt": stage["prompt"],
+        "document": document_hash if stage["uses_document"] else None,
+        "query": query if stage["uses_query"] else None,
+        "context": context,
+    }
+
+    return hashlib.sha256(
+        json.dumps(inputs, sort_keys=True).encode()
+    ).hexdigest()
+
+
+# =====================================================
+# RUNNER
+# =====================================================
+
+def run_stage(stage, inputs):
+
+    stage_crew = Crew(
+        agents=[stage["agent"]],
+        tasks=[stage["task"]],
         process=Process.sequential,
         verbose=False,
         memory=False,
         full_output=True
     )
 
-    result = financial_crew.kickoff(
-        inputs={
-            "query": query,
-            "file_path": file_path
+    TOOL_ERRORS.clear()
+
+    result = stage_crew.kickoff(inputs=inputs)
+
+    if result.tasks_output:
+        return str(result.tasks_output[0].raw)
+
+    return ""
+
+
+def cacheable(content):
+    """Only complete outputs are memoized: non-empty, and no tool failed."""
+
+    return bool(content.strip()) and not TOOL_ERRORS
+
+
+def run_crew(query, file_path, verify=True, db=None, on_stage=None):
+    """
+    Run the analysis stages in order and return one section per stage.
+
+    Stages receive compact, budgeted summaries of their upstream outputs
+    instead of the full prose. With a db session, each stage is memoized on
+    its own inputs (document hash, query, upstream context, prompt version),
+    so a re-run only executes the stages those inputs invalidate.
+    ``on_stage`` is called with each section as soon as its stage finishes.
+    """
+
+    document_hash = file_hash(file_path)
+
+    outputs = {}
+
+    sections = []
+
+    for stage in STAGES:
+
+        # Pre-classifier already confirmed a financial report, skip the LLM check
+        if stage["name"] == "verification" and not verify:
+            continue
+
+        context = stage_context(stage, outputs)
+
+        key = stage_key(stage, document_hash, query, context)
+
+        # Record and replay need every LLM call to go through the transcript,
+        # so skip cache reads
+        content = load_stage(db, key) if db is not None and active_transcript() is None else None
+
+        if content is not None:
+
+            print(f"Stage reused from cache: {stage['name']}")
+
+        else:
+
+            content = run_stage(stage, {
+                "query": query,
+                "file_path": file_path,
+                **context
+            })
+
+            if db is not None and cacheable(content):
+                save_stage(db, key, stage["name"], content)
+                db.commit()
+
+        outputs[stage["name"]] = content
+
+        section = {
+            "stage": stage["name"],
+            "content": content
         }
+
+        sections.append(section)
+
+        if on_stage is not None:
+            on_stage(section)
+
+    return sections
+
+
+def run_comparison(query, file_paths, file_names, db=None, on_stage=None):
+    """
+    Compare a batch of filings in one pipeline run.
+
+    Documents are reduced to metrics in parallel (reusing stored artifacts),
+    and one comparative stage runs over the compact metrics table instead of
+    a full crew per document. Returns the table and the analysis as sections.
+    """
+
+    artifacts = extract_artifacts(file_paths)
+
+    metrics_table = render_metrics_table(
+        build_metrics_table(artifacts, file_names)
     )
 
-    outputs = []
+    sections = [{
+        "stage": "metrics_table",
+        "content": metrics_table
+    }]
+
+    if on_stage is not None:
+        on_stage(sections[0])
+
+    # The batch is identified by its documents, in order
+    batch_hash = hashlib.sha256(
+        ",".join(artifact["hash"] for artifact in artifacts).encode()
+    ).hexdigest()
+
+    context = {"metrics_table": metrics_table}
+
+    key = stage_key(COMPARISON_STAGE, batch_hash, query, context)
+
+    content = load_stage(db, key) if db is not None and active_transcript() is None else None
+
+    if content is not None:
+
+        print(f"Stage reused from cache: {COMPARISON_STAGE['name']}")
+
+    else:
+
+        content = run_stage(COMPARISON_STAGE, {
+            "query": query,
+            **context
+        })
+
+        if db is not None and cacheable(content):
+            save_stage(db, key, COMPARISON_STAGE["name"], content)
+            db.commit()
 
-    if hasattr(result, "tasks_output"):
+    section = {
+        "stage": COMPARISON_STAGE["name"],
+        "content": content
+    }
 
-        for task_output in result.tasks_output:
+    sections.append(section)
 
-            if hasattr(task_output, "raw"):
-                outputs.append(str(task_output.raw))
+    if on_stage is not None:
+        on_stage(section)
 
-    return "\n\n=====================\n\n".join(outputs)
\ No newline at end of file
+    return sections
@@ -0,0 +1,31 @@
+import os
+import json
+
+import redis
+import redis.asyncio as aioredis
+
+
+# =====================================================
+# STAGE EVENTS (Redis pub/sub)
+# =====================================================
+
+EVENTS_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
+
+redis_client = redis.Redis.from_url(EVENTS_URL)
+
+async_redis_client = aioredis.Redis.from_url(EVENTS_URL)
+
+
+def channel_name(analysis_id):
+    return f"analysis:{analysis_id}"
+
+
+def publish_event(analysis_id, **event):
+
+    event["analysis_id"] = analysis_id
+
+    try:
+        redis_client.publish(channel_name(analysis_id), json.dumps(event))
+    except redis.RedisError as e:
+        # Results are already committed, a lost event only delays the client
+        print(f"Publish error: {e}")
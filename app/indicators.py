@@ -0,0 +1,24 @@
+# =====================================================
+# INDICATOR KEYWORDS
+# =====================================================
+
+# Shared by the tools, the local pre-classifier and the artifact store
+
+INVESTMENT_INDICATORS = ("revenue", "income", "cash", "margin", "growth")
+
+RISK_INDICATORS = ("revenue", "income", "cash", "risk", "decline")
+
+FINANCIAL_KEYWORDS = tuple(sorted(set(INVESTMENT_INDICATORS) | set(RISK_INDICATORS) | {
+    "net income",
+    "cash flow",
+    "operating margin",
+    "debt",
+    "liabilities",
+    "assets",
+    "earnings",
+    "balance sheet",
+    "fiscal",
+    "quarter",
+    "ebitda",
+    "per share",
+}))
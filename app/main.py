@@ -1,20 +1,46 @@
 import os
+import json
+import time
 import uuid
 import traceback
 
-from fastapi import FastAPI, File, UploadFile, Form
-from fastapi.responses import JSONResponse
+from typing import List
 
-from app.database import SessionLocal, engine
-from app.models import Base, AnalysisResult
+from fastapi import FastAPI, File, UploadFile, Form, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse, FileResponse
+from fastapi.concurrency import run_in_threadpool
 
-from app.celery_worker import analyze_document_task
+from app.database import SessionLocal, engine
+from app.models import AnalysisResult, init_schema
+
+from app.celery_worker import analyze_document_task, compare_documents_task
+from app.classifier import classify_document, format_classification
+from app.storage import load_result
+from app.metrics import render_metrics
+from app.events import async_redis_client, channel_name
+from app.comparison import MAX_COMPARE_DOCUMENTS
+from app.crew_runner import STAGES
+from app.admission import (
+    rate_limit_client,
+    check_rate_limit,
+    check_storage,
+    admit_work,
+    pending_work,
+    release_work
+)
+
+
+# Create tables and add columns introduced since the first deployment
+init_schema(engine)
 
+app = FastAPI(title="Financial Document Analyzer API")
 
-# Create tables
-Base.metadata.create_all(bind=engine)
+# SSE comment interval, keeps proxies from closing a quiet stream
+SSE_KEEPALIVE_SECONDS = int(os.getenv("SSE_KEEPALIVE_SECONDS", "15"))
 
-app = FastAPI(title="Financial Document Analyzer API")
+# Without events for this long the stream re-reads the stored result, in
+# case the job ended without publishing (killed worker, Redis outage)
+SSE_IDLE_TIMEOUT = int(os.getenv("SSE_IDLE_TIMEOUT", "60"))
 
 
 # Health check
@@ -26,13 +52,59 @@ async def root():
     }
 
 
+# =====================================================
+# ADMISSION CONTROL
+# =====================================================
+
+def client_id(request):
+    return rate_limit_client(
+        request.headers.get("X-API-Key"),
+        request.client.host if request.client else None
+    )
+
+
+def retry_response(status_code, message, retry_after):
+    return JSONResponse(
+        status_code=status_code,
+        headers={"Retry-After": str(retry_after)},
+        content={
+            "status": "error",
+            "message": message,
+            "retry_after": retry_after
+        }
+    )
+
+
+def admission_response(request, cost=1):
+    """429/503 response if the upload must be turned away before saving."""
+
+    retry_after = check_rate_limit(client_id(request), cost)
+
+    if retry_after:
+        return retry_response(429, "Rate limit exceeded", retry_after)
+
+    retry_after = check_storage()
+
+    if retry_after:
+        return retry_response(503, "Insufficient storage, try again later", retry_after)
+
+    return None
+
+
 # Submit analysis job (ASYNC)
 @app.post("/analyze")
 async def analyze_financial_document_api(
+    request: Request,
     file: UploadFile = File(...),
-    query: str = Form(default="Analyze this financial document for investment insights")
+    query: str = Form(default="Analyze this financial document for investment insights"),
+    profile: bool = Form(default=False)
 ):
 
+    rejection = admission_response(request)
+
+    if rejection:
+        return rejection
+
     file_id = str(uuid.uuid4())
 
     os.makedirs("data", exist_ok=True)
@@ -50,28 +122,79 @@ async def analyze_financial_document_api(
         print("ID:", file_id)
         print("---------------------\n")
 
-        # Save job to database
-        db = SessionLocal()
+        # Fast local pre-classification, no LLM call; pypdf parsing is
+        # CPU-bound, keep it off the event loop
+        classification = await run_in_threadpool(classify_document, file_path)
 
-        record = AnalysisResult(
-            id=file_id,
-            file_name=file.filename,
-            query=query,
-            status="processing",
-            result=""
-        )
+        if classification["label"] != "non_financial":
 
-        db.add(record)
-        db.commit()
-        db.close()
+            # Estimated work: pages x LLM stages this job will run
+            stage_count = len(STAGES) - (classification["label"] == "financial")
+            work_units = max(classification["pages"], 1) * stage_count
 
-        # Send to Celery worker
-        analyze_document_task.delay(
-            analysis_id=file_id,
-            query=query.strip(),
-            file_path=file_path,
-            file_name=file.filename
-        )
+            # Reserved until the worker releases it, or the reservation expires
+            retry_after = admit_work(file_id, work_units)
+
+            if retry_after:
+                os.remove(file_path)
+                return retry_response(503, "Analysis queue is full, try again later", retry_after)
+
+        if classification["label"] == "non_financial":
+
+            db = SessionLocal()
+
+            record = AnalysisResult(
+                id=file_id,
+                file_name=file.filename,
+                query=query,
+                status="rejected",
+                result=format_classification(classification)
+            )
+
+            db.add(record)
+            db.commit()
+            db.close()
+
+            os.remove(file_path)
+
+            return JSONResponse(
+                status_code=200,
+                content={
+                    "status": "rejected",
+                    "analysis_id": file_id,
+                    "message": f"Document is not a financial report: {classification['reason']}"
+                }
+            )
+
+        try:
+
+            # Save job to database
+            db = SessionLocal()
+
+            record = AnalysisResult(
+                id=file_id,
+                file_name=file.filename,
+                query=query,
+                status="processing",
+                result=""
+            )
+
+            db.add(record)
+            db.commit()
+            db.close()
+
+            # Send to Celery worker, which releases the reserved work when done
+            analyze_document_task.delay(
+                analysis_id=file_id,
+                query=query.strip(),
+                file_path=file_path,
+                file_name=file.filename,
+                classification=classification,
+                profile=profile or request.headers.get("X-Profile") == "1"
+            )
+        except Exception:
+            release_work(file_id)
+            raise
 
         # Return immediately (non-blocking)
         return JSONResponse(
@@ -96,6 +219,134 @@ async def analyze_financial_document_api(
         )
 
 
+# Submit comparison job over several filings (ASYNC)
+@app.post("/compare")
+async def compare_financial_documents_api(
+    request: Request,
+    files: List[UploadFile] = File(...),
+    query: str = Form(default="Compare these financial documents period over period")
+):
+
+    if not 2 <= len(files) <= MAX_COMPARE_DOCUMENTS:
+        return JSONResponse(
+            status_code=400,
+            content={
+                "status": "error",
+                "message": f"Upload between 2 and {MAX_COMPARE_DOCUMENTS} documents to compare"
+            }
+        )
+
+    rejection = admission_response(request, cost=len(files))
+
+    if rejection:
+        return rejection
+
+    analysis_id = str(uuid.uuid4())
+
+    os.makedirs("data", exist_ok=True)
+
+    file_paths = []
+
+    try:
+
+        # Save files
+        for position, file in enumerate(files):
+
+            file_path = f"data/financial_document_{analysis_id}_{position}.pdf"
+
+            with open(file_path, "wb") as f:
+                f.write(await file.read())
+
+            file_paths.append(file_path)
+
+        file_names = [file.filename for file in files]
+
+        print("\n--- COMPARISON SUBMITTED ---")
+        print("Files:", ", ".join(file_names))
+        print("ID:", analysis_id)
+        print("----------------------------\n")
+
+        pages = 0
+
+        # Every document must pass the local pre-classifier
+        for file_name, file_path in zip(file_names, file_paths):
+
+            classification = await run_in_threadpool(classify_document, file_path)
+            pages += classification["pages"]
+
+            if classification["label"] == "non_financial":
+
+                for path in file_paths:
+                    os.remove(path)
+
+                return JSONResponse(
+                    status_code=422,
+                    content={
+                        "status": "rejected",
+                        "message": f"{file_name} is not a financial report: {classification['reason']}"
+                    }
+                )
+
+        # One comparative stage over all pages
+        work_units = max(pages, 1)
+
+        retry_after = admit_work(analysis_id, work_units)
+
+        if retry_after:
+            for path in file_paths:
+                os.remove(path)
+            return retry_response(503, "Analysis queue is full, try again later", retry_after)
+
+        try:
+
+            # Save job to database
+            db = SessionLocal()
+
+            record = AnalysisResult(
+                id=analysis_id,
+                file_name=", ".join(file_names)[:255],
+                query=query,
+                status="processing",
+                result=""
+            )
+
+            db.add(record)
+            db.commit()
+            db.close()
+
+            # Send to Celery worker, which releases the reserved work when done
+            compare_documents_task.delay(
+                analysis_id=analysis_id,
+                query=query.strip(),
+                file_paths=file_paths,
+                file_names=file_names
+            )
+        except Exception:
+            release_work(analysis_id)
+            raise
+
+        return JSONResponse(
+            status_code=202,
+            content={
+                "status": "processing",
+                "analysis_id": analysis_id,
+                "message": "Comparison started. Use /result/{analysis_id}"
+            }
+        )
+
+    except Exception as e:
+
+        traceback.print_exc()
+
+        return JSONResponse(
+            status_code=500,
+            content={
+                "status": "error",
+                "message": str(e)
+            }
+        )
+
+
 # Get analysis result
 @app.get("/result/{analysis_id}")
 def get_analysis_result(analysis_id: str):
@@ -124,7 +375,9 @@ def get_analysis_result(analysis_id: str):
             "file_name": record.file_name,
             "query": record.query,
             "status": record.status,
-            "result": record.result,
+            "stages_completed": record.stages_completed or 0,
+            "profile_available": bool(record.profile_path),
+            "result": load_result(db, record),
             "created_at": record.created_at
 
         }
@@ -134,6 +387,138 @@ def get_analysis_result(analysis_id: str):
         db.close()
 
 
+# Download the sampling profile of a profiled job
+@app.get("/result/{analysis_id}/profile")
+def get_analysis_profile(analysis_id: str):
+
+    db = SessionLocal()
+
+    try:
+
+        record = db.query(AnalysisResult).filter(
+            AnalysisResult.id == analysis_id
+        ).first()
+
+        if not record or not record.profile_path or not os.path.exists(record.profile_path):
+
+            return JSONResponse(
+                status_code=404,
+                content={
+                    "status": "error",
+                    "message": "No profile for this analysis"
+                }
+            )
+
+        return FileResponse(
+            record.profile_path,
+            media_type="application/json",
+            filename=f"profile_{analysis_id}.json"
+        )
+
+    finally:
+
+        db.close()
+
+
+# Stream stage outputs as they are committed (Server-Sent Events)
+@app.get("/result/{analysis_id}/stream")
+async def stream_analysis_result(analysis_id: str):
+
+    async def events():
+
+        pubsub = async_redis_client.pubsub()
+
+        # Subscribe before reading the snapshot so no stage is missed
+        await pubsub.subscribe(channel_name(analysis_id))
+
+        try:
+
+            snapshot = await run_in_threadpool(get_analysis_result, analysis_id)
+
+            if isinstance(snapshot, JSONResponse):
+                yield f"data: {snapshot.body.decode()}\n\n"
+                return
+
+            yield f"data: {json.dumps(snapshot, default=str)}\n\n"
+
+            if snapshot["status"] != "processing":
+                return
+
+            stages_completed = snapshot["stages_completed"]
+            last_event = time.monotonic()
+
+            while True:
+
+                message = await pubsub.get_message(
+                    ignore_subscribe_messages=True,
+                    timeout=SSE_KEEPALIVE_SECONDS
+                )
+
+                if message is None:
+
+                    yield ": keepalive\n\n"
+
+                    if time.monotonic() - last_event < SSE_IDLE_TIMEOUT:
+                        continue
+
+                    last_event = time.monotonic()
+
+                    snapshot = await run_in_threadpool(get_analysis_result, analysis_id)
+
+                    if isinstance(snapshot, JSONResponse):
+                        yield f"data: {snapshot.body.decode()}\n\n"
+                        return
+
+                    # Only send what the client has not seen
+                    if snapshot["status"] != "processing" or snapshot["stages_completed"] != stages_completed:
+                        stages_completed = snapshot["stages_completed"]
+                        yield f"data: {json.dumps(snapshot, default=str)}\n\n"
+
+                    if snapshot["status"] != "processing":
+                        return
+
+                    continue
+
+                last_event = time.monotonic()
+
+                data = message["data"].decode()
+
+                yield f"data: {data}\n\n"
+
+                event = json.loads(data)
+
+                stages_completed = event.get("stages_completed", stages_completed)
+
+                if event["status"] != "processing":
+                    return
+
+        finally:
+
+            await pubsub.unsubscribe(channel_name(analysis_id))
+            await pubsub.close()
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+# Queue depth feed for worker autoscaling
+@app.get("/metrics")
+def metrics():
+
+    db = SessionLocal()
+
+    try:
+
+        processing_jobs = db.query(AnalysisResult).filter(
+            AnalysisResult.status == "processing"
+        ).count()
+
+        return PlainTextResponse(render_metrics(processing_jobs, pending_work()))
+
+    finally:
+
+        db.close()
+
+
 # Run locally
 if __name__ == "__main__":
 
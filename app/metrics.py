@@ -0,0 +1,45 @@
+import os
+
+import redis
+
+
+# =====================================================
+# QUEUE METRICS
+# =====================================================
+
+BROKER_URL = os.getenv("CELERY_BROKER_URL", "redis://redis:6379/0")
+
+QUEUE_NAME = "celery"
+
+redis_client = redis.Redis.from_url(BROKER_URL)
+
+
+def queue_depth():
+    """Tasks waiting in the broker, not yet reserved by any worker."""
+    return redis_client.llen(QUEUE_NAME)
+
+
+def unacked_count():
+    """Tasks reserved by workers (running or prefetched, acks_late)."""
+    return redis_client.hlen("unacked")
+
+
+def render_metrics(processing_jobs, pending_work):
+    """Prometheus text format, scraped for worker autoscaling."""
+
+    lines = [
+        "# HELP financial_queue_depth Tasks waiting in the broker queue",
+        "# TYPE financial_queue_depth gauge",
+        f"financial_queue_depth {queue_depth()}",
+        "# HELP financial_tasks_unacked Tasks reserved by workers",
+        "# TYPE financial_tasks_unacked gauge",
+        f"financial_tasks_unacked {unacked_count()}",
+        "# HELP financial_jobs_processing Analyses with status processing",
+        "# TYPE financial_jobs_processing gauge",
+        f"financial_jobs_processing {processing_jobs}",
+        "# HELP financial_pending_work Admitted, unfinished work in pages x stages",
+        "# TYPE financial_pending_work gauge",
+        f"financial_pending_work {pending_work}",
+    ]
+
+    return "\n".join(lines) + "\n"
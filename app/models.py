@@ -1,4 +1,6 @@
-from sqlalchemy import Column, String, Text, DateTime
+from sqlalchemy import Column, String, Text, DateTime, Integer, LargeBinary, ForeignKey
+from sqlalchemy import inspect, text
+from sqlalchemy.exc import OperationalError, ProgrammingError
 from app.database import Base
 from datetime import datetime
 
@@ -17,4 +19,91 @@ class AnalysisResult(Base):
 
     status = Column(String(50))
 
-    created_at = Column(DateTime, default=datetime.utcnow)
\ No newline at end of file
+    stages_completed = Column(Integer, default=0)
+
+    profile_path = Column(String(255))
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class ResultSection(Base):
+
+    # Content-addressed, zstd-compressed section text shared by all analyses
+
+    __tablename__ = "result_sections"
+
+    hash = Column(String(64), primary_key=True)
+
+    content = Column(LargeBinary(length=16777215))
+
+    size = Column(Integer)
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class AnalysisSection(Base):
+
+    __tablename__ = "analysis_sections"
+
+    analysis_id = Column(String(50), ForeignKey("analysis_results.id"), primary_key=True)
+
+    position = Column(Integer, primary_key=True)
+
+    stage = Column(String(50))
+
+    section_hash = Column(String(64), ForeignKey("result_sections.hash"))
+
+
+class StageCache(Base):
+
+    # Memoized stage output keyed by a hash of everything the stage reads
+
+    __tablename__ = "stage_cache"
+
+    key = Column(String(64), primary_key=True)
+
+    stage = Column(String(50))
+
+    section_hash = Column(String(64), ForeignKey("result_sections.hash"))
+
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+# =====================================================
+# SCHEMA
+# =====================================================
+
+def add_missing_columns(engine, table):
+    """
+    ALTER TABLE ... ADD COLUMN for model columns an existing table lacks.
+
+    create_all never changes tables that already exist, so columns added
+    after a deployment's first start are added here. Safe to run on every
+    start and from several processes at once.
+    """
+
+    existing = {column["name"] for column in inspect(engine).get_columns(table.name)}
+
+    for column in table.columns:
+
+        if column.name in existing:
+            continue
+
+        ddl = f"ALTER TABLE {table.name} ADD COLUMN {column.name} {column.type.compile(dialect=engine.dialect)}"
+
+        if column.default is not None and isinstance(column.default.arg, int):
+            ddl += f" DEFAULT {column.default.arg}"
+
+        try:
+            with engine.begin() as conn:
+                conn.execute(text(ddl))
+            print(f"Added column {table.name}.{column.name}")
+        except (OperationalError, ProgrammingError):
+            # Another process added it first
+            if column.name not in {c["name"] for c in inspect(engine).get_columns(table.name)}:
+                raise
+
+
+def init_schema(engine):
+    Base.metadata.create_all(bind=engine)
+    add_missing_columns(engine, AnalysisResult.__table__)
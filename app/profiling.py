@@ -0,0 +1,222 @@
+import os
+import sys
+import json
+import time
+import random
+import resource
+import threading
+import tracemalloc
+from collections import Counter
+
+
+# =====================================================
+# CONFIG
+# =====================================================
+
+# Share of jobs profiled without being asked to (0.0 - 1.0)
+PROFILE_SAMPLE_RATE = float(os.getenv("PROFILE_SAMPLE_RATE", "0"))
+
+PROFILE_INTERVAL = float(os.getenv("PROFILE_INTERVAL_MS", "10")) / 1000
+
+# tracemalloc slows every allocation, so it only runs for jobs that asked
+# to be profiled; sampled jobs get it too with PROFILE_SAMPLE_MEMORY=1
+PROFILE_SAMPLE_MEMORY = os.getenv("PROFILE_SAMPLE_MEMORY", "0") == "1"
+
+# Python frames kept per allocation site; each extra frame adds overhead
+PROFILE_TRACEMALLOC_FRAMES = int(os.getenv("PROFILE_TRACEMALLOC_FRAMES", "1"))
+
+PROFILE_DIR = os.getenv("PROFILE_DIR", "data/profiles")
+
+TOP_ALLOCATIONS = 25
+
+
+def should_profile(requested):
+    return bool(requested) or random.random() < PROFILE_SAMPLE_RATE
+
+
+def profile_path(analysis_id):
+    return os.path.join(PROFILE_DIR, f"{analysis_id}.json")
+
+
+# =====================================================
+# SAMPLER
+# =====================================================
+
+def collapse(frame):
+    """Stack as "file:function;..." root first, the collapsed flamegraph format."""
+
+    names = []
+
+    while frame is not None:
+        code = frame.f_code
+        names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+        frame = frame.f_back
+
+    return ";".join(reversed(names))
+
+
+def thread_cpu_time(ident):
+
+    try:
+        return time.clock_gettime(time.pthread_getcpuclockid(ident))
+    except (AttributeError, OSError):
+        # Not available on this platform or the thread already exited
+        return None
+
+
+def current_rss():
+    """Resident set size of this process in bytes, None without procfs."""
+
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * resource.getpagesize()
+    except (OSError, IndexError, ValueError):
+        return None
+
+
+class JobProfiler:
+    """
+    Low-overhead sampling profiler for one job.
+
+    A background thread snapshots every thread's stack each interval. Wall
+    samples count every stack; CPU time is attributed to a thread's stack
+    only when its own CPU clock advanced since the previous sample, so
+    threads blocked on the LLM or MySQL show up in wall time but not CPU.
+    The sampler also tracks resident memory, so every profile has this
+    job's RSS peak over its starting value. With ``trace_memory``,
+    tracemalloc also records the allocation peak and the largest sites.
+    """
+
+    def __init__(self, analysis_id, interval=PROFILE_INTERVAL, trace_memory=False):
+
+        self.analysis_id = analysis_id
+        self.interval = interval
+        self.trace_memory = trace_memory
+
+        self.wall = Counter()
+        self.cpu = Counter()
+        self.samples = 0
+
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.sample, name="job-profiler", daemon=True)
+
+    def start(self):
+
+        if self.trace_memory:
+            tracemalloc.start(PROFILE_TRACEMALLOC_FRAMES)
+
+        self.rss_start = current_rss()
+        self.rss_peak = self.rss_start
+
+        self.started = time.perf_counter()
+        self.started_cpu = time.process_time()
+
+        self.thread.start()
+
+        return self
+
+    def sample(self):
+
+        own = threading.get_ident()
+        last_cpu = {}
+
+        while not self.stopped.wait(self.interval):
+
+            for ident, frame in sys._current_frames().items():
+
+                if ident == own:
+                    continue
+
+                stack = collapse(frame)
+
+                self.wall[stack] += 1
+
+                cpu = thread_cpu_time(ident)
+
+                if cpu is not None:
+                    previous = last_cpu.get(ident, cpu)
+                    if cpu > previous:
+                        self.cpu[stack] += cpu - previous
+                    last_cpu[ident] = cpu
+
+            rss = current_rss()
+
+            if rss is not None and (self.rss_peak is None or rss > self.rss_peak):
+                self.rss_peak = rss
+
+            self.samples += 1
+
+    def stop(self):
+
+        self.stopped.set()
+        self.thread.join()
+
+        duration = time.perf_counter() - self.started
+        cpu_seconds = time.process_time() - self.started_cpu
+
+        rss_end = current_rss()
+
+        if rss_end is not None and (self.rss_peak is None or rss_end > self.rss_peak):
+            self.rss_peak = rss_end
+
+        memory = {
+            "rss_start_bytes": self.rss_start,
+            "rss_peak_bytes": self.rss_peak,
+            # What this job added on top of the pool process it ran in
+            "job_rss_growth_bytes": (
+                self.rss_peak - self.rss_start
+                if self.rss_start is not None and self.rss_peak is not None
+                else None
+            ),
+            # Peak over the pool process's whole life, which spans earlier
+            # jobs (WORKER_MAX_TASKS_PER_CHILD); Linux reports kilobytes
+            "process_lifetime_max_rss_bytes": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024,
+        }
+
+        if self.trace_memory:
+
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+
+            memory["traced_peak_bytes"] = peak
+            memory["traced_current_bytes"] = current
+            memory["top_allocations"] = [
+                {
+                    "site": str(stat.traceback[0]),
+                    "size_bytes": stat.size,
+                    "count": stat.count,
+                }
+                for stat in snapshot.statistics("lineno")[:TOP_ALLOCATIONS]
+            ]
+
+        return {
+            "analysis_id": self.analysis_id,
+            "duration_seconds": round(duration, 3),
+            "cpu_seconds": round(cpu_seconds, 3),
+            "interval_seconds": self.interval,
+            "samples": self.samples,
+            "memory": memory,
+            # "stack count" lines, loadable in speedscope or flamegraph.pl
+            "wall_collapsed": "\n".join(
+                f"{stack} {count}" for stack, count in self.wall.most_common()
+            ),
+            "cpu_collapsed": "\n".join(
+                f"{stack} {round(seconds * 1000)}"
+                for stack, seconds in self.cpu.most_common()
+                if round(seconds * 1000)
+            ),
+        }
+
+    def save(self):
+
+        profile = self.stop()
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+
+        path = profile_path(self.analysis_id)
+
+        with open(path, "w") as f:
+            json.dump(profile, f)
+
+        return path
@@ -0,0 +1,361 @@
+import os
+import sys
+import json
+import time
+import hashlib
+import uuid
+import argparse
+import threading
+from collections import defaultdict, deque
+from contextlib import contextmanager
+
+from crewai import LLM
+
+from app.artifacts import file_hash
+
+
+# =====================================================
+# CONFIG
+# =====================================================
+
+# off    — live calls only
+# record — live calls, each request/response/timing appended to a transcript
+# replay — responses served from the transcript, no network
+LLM_REPLAY_MODE = os.getenv("LLM_REPLAY_MODE", "off")
+
+# original — sleep for the recorded call time; zero — return immediately
+LLM_REPLAY_LATENCY = os.getenv("LLM_REPLAY_LATENCY", "original")
+
+TRANSCRIPT_DIR = os.getenv("TRANSCRIPT_DIR", "data/transcripts")
+
+
+class ReplayMissError(RuntimeError):
+    pass
+
+
+# =====================================================
+# TRANSCRIPT
+# =====================================================
+
+def transcript_path(analysis_id):
+    return os.path.join(TRANSCRIPT_DIR, f"{analysis_id}.jsonl")
+
+
+def request_hash(request, file_path=None):
+    """
+    Match key for a call. The upload path is interpolated into the prompts
+    and differs between the recorded job and a replay, so it is replaced
+    by a placeholder before hashing.
+    """
+
+    payload = json.dumps(request, sort_keys=True, default=str)
+
+    if file_path:
+        payload = payload.replace(json.dumps(file_path)[1:-1], "<file_path>")
+
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+
+def transcript_meta(analysis_id):
+    """Meta line of a recorded transcript, {} if there is none."""
+
+    path = transcript_path(analysis_id)
+
+    if not os.path.exists(path):
+        return {}
+
+    with open(path) as f:
+        entry = json.loads(f.readline() or "{}")
+
+    return entry if entry.get("type") == "meta" else {}
+
+
+class Transcript:
+
+    def __init__(self, analysis_id, mode, latency=LLM_REPLAY_LATENCY, file_path=None):
+
+        self.analysis_id = analysis_id
+        self.mode = mode
+        self.latency = latency
+        self.file_path = file_path
+        self.path = transcript_path(analysis_id)
+
+        # CrewAI calls the LLM from its own timeout threads
+        self.lock = threading.Lock()
+
+        self.calls = 0
+        self.llm_seconds = 0.0
+
+        self.by_hash = defaultdict(deque)
+        self.in_order = deque()
+        self.meta = {}
+
+        if mode == "replay":
+            self.load()
+
+    def load(self):
+
+        if not os.path.exists(self.path):
+            raise ReplayMissError(f"No transcript for {self.analysis_id}")
+
+        with open(self.path) as f:
+            for line in f:
+
+                entry = json.loads(line)
+
+                if entry["type"] == "meta":
+                    self.meta = entry
+                    continue
+
+                self.by_hash[entry["hash"]].append(entry)
+                self.in_order.append(entry)
+
+    def start(self, meta):
+
+        os.makedirs(TRANSCRIPT_DIR, exist_ok=True)
+
+        # Re-recording an analysis replaces its transcript
+        with open(self.path, "w") as f:
+            f.write(json.dumps({"type": "meta", **meta}, default=str) + "\n")
+
+    def record(self, request, response, elapsed):
+
+        with self.lock:
+
+            self.calls += 1
+            self.llm_seconds += elapsed
+
+            entry = {
+                "type": "call",
+                "seq": self.calls,
+                "hash": request_hash(request, self.file_path),
+                "request": request,
+                "response": response,
+                "elapsed": elapsed,
+            }
+
+            with open(self.path, "a") as f:
+                f.write(json.dumps(entry, default=str) + "\n")
+
+    def replay(self, request):
+
+        with self.lock:
+
+            matches = self.by_hash.get(request_hash(request, self.file_path))
+
+            if not matches:
+                raise ReplayMissError(
+                    f"Transcript {self.analysis_id} has no response for call "
+                    f"{self.calls + 1}; prompts or inputs changed since recording"
+                )
+
+            entry = matches.popleft()
+            self.in_order.remove(entry)
+
+            self.calls += 1
+            self.llm_seconds += entry["elapsed"]
+
+        if self.latency == "original":
+            time.sleep(entry["elapsed"])
+
+        return entry["response"]
+
+
+# Celery prefork runs one task per process at a time, and CrewAI moves agent
+# execution to worker threads (so a contextvar would not follow it)
+_active = None
+
+
+def active_transcript():
+    return _active
+
+
+@contextmanager
+def transcript_session(analysis_id, mode=LLM_REPLAY_MODE, latency=LLM_REPLAY_LATENCY, file_path=None, file_paths=None, **meta):
+    """
+    Record or replay every LLM call made inside the block. ``file_path`` is
+    the PDF the prompts refer to, ``file_paths`` the documents of a
+    comparison; recordings store their sha256 so a replay can check them.
+    """
+
+    global _active
+
+    if mode == "off":
+        yield None
+        return
+
+    transcript = Transcript(analysis_id, mode, latency, file_path)
+
+    if mode == "record":
+
+        if file_path:
+            meta["file_path"] = file_path
+            meta["document_hash"] = file_hash(file_path)
+
+        if file_paths:
+            meta["document_hashes"] = [file_hash(path) for path in file_paths]
+
+        transcript.start(meta)
+
+    _active = transcript
+
+    try:
+        yield transcript
+    finally:
+        _active = None
+
+
+# =====================================================
+# LLM
+# =====================================================
+
+class ReplayLLM(LLM):
+    """LLM whose calls go through the active transcript, if any."""
+
+    # CrewAI adds keyword arguments to LLM.call between releases, pass them through
+    def call(self, messages, *args, **kwargs):
+
+        transcript = active_transcript()
+
+        if transcript is None:
+            return super().call(messages, *args, **kwargs)
+
+        tools = args[0] if args else kwargs.get("tools")
+
+        request = {
+            "model": self.model,
+            "messages": messages,
+            "tools": tools,
+        }
+
+        if transcript.mode == "replay":
+            return transcript.replay(request)
+
+        started = time.perf_counter()
+
+        response = super().call(messages, *args, **kwargs)
+
+        transcript.record(request, response, time.perf_counter() - started)
+
+        return response
+
+
+# =====================================================
+# CLI: offline re-run for profiling pipeline overhead
+# =====================================================
+
+def main(argv=None):
+
+    # Imported here so the CLI pulls in the crew only when run directly
+    from app.crew_runner import run_crew, run_comparison
+
+    parser = argparse.ArgumentParser(
+        description="Re-run a recorded analysis or comparison against its LLM transcript"
+    )
+    parser.add_argument("analysis_id")
+    parser.add_argument("file_paths", nargs="+", help="The PDF(s) the job was recorded on, in upload order")
+    parser.add_argument("--query", help="Defaults to the recorded query")
+    parser.add_argument("--latency", choices=["original", "zero"], default="zero")
+    parser.add_argument("--no-verify", action="store_true", help="Skip the verification stage even if it was recorded")
+    parser.add_argument("--db", action="store_true", help="Include the worker's DB writes, against a scratch analysis row")
+    args = parser.parse_args(argv)
+
+    # Transcripts from before jobs were tagged are single-document analyses
+    job = transcript_meta(args.analysis_id).get("job", "analyze")
+
+    if job == "analyze" and len(args.file_paths) != 1:
+        parser.error(f"{args.analysis_id} is an analysis of one document")
+
+    file_path = args.file_paths[0] if job == "analyze" else None
+
+    with transcript_session(args.analysis_id, mode="replay", latency=args.latency, file_path=file_path) as transcript:
+
+        if job == "analyze":
+            recorded_hashes = [transcript.meta["document_hash"]] if transcript.meta.get("document_hash") else None
+        else:
+            recorded_hashes = transcript.meta.get("document_hashes")
+
+        if recorded_hashes and [file_hash(path) for path in args.file_paths] != recorded_hashes:
+            parser.error(f"{' '.join(args.file_paths)} are not the documents recorded for {args.analysis_id}")
+
+        query = args.query or transcript.meta.get("query", "")
+        verify = transcript.meta.get("verify", True) and not args.no_verify
+
+        db = None
+        record = None
+        recorder = None
+
+        if args.db:
+            # Same per-stage writes as the worker: stage cache, sections,
+            # commits and progress events, under a row deleted afterwards
+            from app.database import SessionLocal
+            from app.models import AnalysisResult
+            from app.storage import clear_sections
+            from app.celery_worker import stage_recorder
+
+            db = SessionLocal()
+
+            record = AnalysisResult(
+                id=f"replay-{uuid.uuid4()}",
+                file_name=f"replay of {args.analysis_id}",
+                query=query,
+                status="processing",
+                result=""
+            )
+
+            db.add(record)
+            db.commit()
+
+            recorder = stage_recorder(db, record, record.id, [])
+
+        timings = []
+
+        def on_stage(section):
+            if recorder is not None:
+                recorder(section)
+            timings.append((section["stage"], time.perf_counter()))
+
+        started = time.perf_counter()
+
+        try:
+            if job == "compare":
+                run_comparison(
+                    query=query,
+                    file_paths=args.file_paths,
+                    file_names=transcript.meta.get("file_names") or [os.path.basename(path) for path in args.file_paths],
+                    db=db,
+                    on_stage=on_stage
+                )
+            else:
+                run_crew(query=query, file_path=file_path, verify=verify, db=db, on_stage=on_stage)
+
+            total = time.perf_counter() - started
+
+        finally:
+            if db is not None:
+                clear_sections(db, record.id)
+                db.delete(record)
+                db.commit()
+                db.close()
+
+    previous = started
+
+    for stage, finished in timings:
+        print(f"{stage:<22} {finished - previous:8.3f}s")
+        previous = finished
+
+    print(f"{'total':<22} {total:8.3f}s")
+    print(f"{'llm calls':<22} {transcript.calls:8d}")
+    print(f"{'recorded llm time':<22} {transcript.llm_seconds:8.3f}s")
+
+    if args.latency == "zero":
+        print(f"{'pipeline overhead':<22} {total:8.3f}s")
+    else:
+        print(f"{'pipeline overhead':<22} {total - transcript.llm_seconds:8.3f}s")
+
+    if transcript.in_order:
+        print(f"warning: {len(transcript.in_order)} recorded calls were not replayed", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,173 @@
+import os
+import hashlib
+from datetime import datetime, timedelta
+
+import zstandard
+from sqlalchemy.exc import IntegrityError
+
+from app.models import ResultSection, AnalysisSection, StageCache
+
+
+ZSTD_LEVEL = int(os.getenv("RESULT_ZSTD_LEVEL", "10"))
+
+SECTION_SEPARATOR = "\n\n=====================\n\n"
+
+# Memoized stage outputs older than this are re-run and pruned
+STAGE_CACHE_TTL_DAYS = int(os.getenv("STAGE_CACHE_TTL_DAYS", "7"))
+
+
+# =====================================================
+# SECTION STORE
+# =====================================================
+
+def content_hash(content):
+    return hashlib.sha256(content.encode()).hexdigest()
+
+
+def put_content(db, content):
+    """Store compressed text once per content hash. Caller commits."""
+
+    section_hash = content_hash(content)
+
+    if db.get(ResultSection, section_hash) is None:
+
+        try:
+            # Savepoint so a concurrent insert of the same hash does not
+            # roll back the caller's transaction
+            with db.begin_nested():
+                db.add(ResultSection(
+                    hash=section_hash,
+                    content=zstandard.compress(content.encode(), ZSTD_LEVEL),
+                    size=len(content)
+                ))
+        except IntegrityError:
+            pass
+
+    return section_hash
+
+
+def get_content(db, section_hash):
+
+    section = db.get(ResultSection, section_hash)
+
+    if section is None:
+        return None
+
+    return zstandard.decompress(section.content).decode()
+
+
+def store_section(db, analysis_id, position, stage, content):
+    """
+    Attach one stage output to an analysis.
+
+    The text is compressed and stored once per content hash, so re-analyses
+    of the same document only add a small link row. Caller commits.
+    """
+
+    section_hash = put_content(db, content)
+
+    db.merge(AnalysisSection(
+        analysis_id=analysis_id,
+        position=position,
+        stage=stage,
+        section_hash=section_hash
+    ))
+
+    return section_hash
+
+
+def clear_sections(db, analysis_id):
+    """Unlink every section of an analysis, e.g. before a retry. Caller commits."""
+
+    db.query(AnalysisSection).filter(
+        AnalysisSection.analysis_id == analysis_id
+    ).delete(synchronize_session=False)
+
+
+def stage_cache_cutoff():
+    return datetime.utcnow() - timedelta(days=STAGE_CACHE_TTL_DAYS)
+
+
+def load_stage(db, key):
+    """Memoized stage output, or None if missing, expired or empty."""
+
+    entry = db.get(StageCache, key)
+
+    if entry is None:
+        return None
+
+    if entry.created_at is not None and entry.created_at < stage_cache_cutoff():
+        db.delete(entry)
+        db.commit()
+        return None
+
+    content = get_content(db, entry.section_hash)
+
+    # Entries written before empty outputs were refused
+    if not content or not content.strip():
+        return None
+
+    return content
+
+
+def save_stage(db, key, stage, content):
+    """Memoize a stage output under its input key. Caller commits."""
+
+    db.merge(StageCache(
+        key=key,
+        stage=stage,
+        section_hash=put_content(db, content),
+        created_at=datetime.utcnow()
+    ))
+
+
+def prune_stage_cache(db):
+    """Delete expired stage cache entries; their sections stay for results."""
+
+    pruned = (
+        db.query(StageCache)
+        .filter(StageCache.created_at < stage_cache_cutoff())
+        .delete(synchronize_session=False)
+    )
+
+    db.commit()
+
+    return pruned
+
+
+def load_sections(db, analysis_id):
+
+    rows = (
+        db.query(AnalysisSection, ResultSection)
+        .join(ResultSection, AnalysisSection.section_hash == ResultSection.hash)
+        .filter(AnalysisSection.analysis_id == analysis_id)
+        .order_by(AnalysisSection.position)
+        .all()
+    )
+
+    return [
+        {
+            "stage": link.stage,
+            "content": zstandard.decompress(section.content).decode()
+        }
+        for link, section in rows
+    ]
+
+
+def join_sections(sections):
+    return SECTION_SEPARATOR.join(section["content"] for section in sections)
+
+
+def load_result(db, record):
+    """
+    Full result text: stored sections (possibly partial while processing)
+    followed by any inline text, which holds rejection/failure messages and
+    results written before section storage.
+    """
+
+    sections = load_sections(db, record.id)
+
+    if record.result:
+        sections.append({"stage": "message", "content": record.result})
+
+    return join_sections(sections)
@@ -1,8 +1,13 @@
 from crewai import Task
-from app.agents import financial_analyst, verifier, investment_advisor, risk_assessor
+from app.agents import financial_analyst, verifier, investment_advisor, risk_assessor, comparative_analyst
 from app.tools import read_data_tool
 
 
+# Bump when tool or agent behaviour changes in a way the prompt text does not
+# show; memoized stage outputs from older versions are then ignored
+PROMPT_VERSION = "2"
+
+
 # ✅ 1. Document Verification Task
 verification = Task(
     description=(
@@ -38,6 +43,9 @@ analyze_financial_document = Task(
         "Step 1: Use read_data_tool with "
         "file_path='{file_path}'.\n\n"
 
+        "Verification summary:\n"
+        "{verification_summary}\n\n"
+
         "Step 2: Analyze the extracted financial data.\n\n"
 
         "IMPORTANT RULES:\n"
@@ -88,7 +96,8 @@ analyze_financial_document = Task(
     ),
     agent=financial_analyst,
     tools=[read_data_tool],
-    context=[verification],
+    # Upstream output is passed compacted through {verification_summary}
+    context=[],
     async_execution=False,
 )
 
@@ -96,7 +105,8 @@ analyze_financial_document = Task(
 # ✅ 3. Investment Recommendation Task
 investment_analysis = Task(
     description=(
-        "Step 1: Review financial analysis report.\n\n"
+        "Step 1: Review financial analysis summary:\n"
+        "{analysis_summary}\n\n"
 
         "IMPORTANT RULES:\n"
         "- DO NOT repeat document text\n"
@@ -124,7 +134,7 @@ investment_analysis = Task(
     ),
     agent=investment_advisor,
     tools=[],
-    context=[analyze_financial_document],
+    context=[],
     async_execution=False,
 )
 
@@ -132,13 +142,13 @@ investment_analysis = Task(
 # ✅ 4. Risk Assessment Task
 risk_assessment = Task(
     description=(
-        "Step 1: Use read_data_tool with" 
-        "file_path='{file_path}' to extract document text.\n\n"
+        "Step 1: Review financial analysis summary:\n"
+        "{analysis_summary}\n\n"
 
-        "Step 2: Carefully analyze the extracted financial content.\n\n"
+        "Step 2: Use risk_assessment_tool on the summary above.\n\n"
 
         "CRITICAL INSTRUCTIONS:\n"
-        "- You MUST use the tool output to perform risk analysis\n"
+        "- You MUST use the summary and tool output to perform risk analysis\n"
         "- You MUST generate a structured risk report\n"
         "- You MUST NOT return tool action\n"
         "- You MUST NOT return raw document text\n"
@@ -177,6 +187,54 @@ risk_assessment = Task(
 
     agent=risk_assessor,
     tools=[],
-    context=[analyze_financial_document],
+    context=[],
+    async_execution=False,
+)
+
+
+# ✅ 5. Comparative Analysis Task (comparison mode, one run per batch)
+comparative_analysis = Task(
+    description=(
+        "Step 1: Review the metrics table extracted from the filings:\n"
+        "{metrics_table}\n\n"
+
+        "Rows are documents ordered by reporting period. "
+        "Columns ending in _pop are period-over-period changes (fraction), "
+        "columns ending in _vs_median are relative to the median of all documents.\n\n"
+
+        "IMPORTANT RULES:\n"
+        "- USE ONLY the figures in the table\n"
+        "- Say when a metric is missing instead of guessing\n\n"
+
+        "Step 2: Answer user query '{query}'.\n\n"
+
+        "Step 3: Generate structured comparative analysis report."
+    ),
+    expected_output=(
+        "Comparative Analysis Report:\n\n"
+
+        "Documents Compared:\n"
+        "- Period / company per document\n\n"
+
+        "Revenue Comparison:\n"
+        "- Explanation\n\n"
+
+        "Profitability Comparison:\n"
+        "- Explanation\n\n"
+
+        "Cash Flow and Debt Comparison:\n"
+        "- Explanation\n\n"
+
+        "Key Changes:\n"
+        "- Change 1\n"
+        "- Change 2\n"
+        "- Change 3\n\n"
+
+        "Summary:\n"
+        "- Final comparative summary"
+    ),
+    agent=comparative_analyst,
+    tools=[],
+    context=[],
     async_execution=False,
-)
\ No newline at end of file
+)
@@ -1,11 +1,23 @@
 from crewai.tools import BaseTool
-from pypdf import PdfReader
 from pydantic import BaseModel, Field
 from typing import Type
 import os
-import re
 import hashlib
 
+from app.indicators import INVESTMENT_INDICATORS, RISK_INDICATORS
+from app.artifacts import get_artifact, read_text
+
+
+# Errors returned by tools during the current stage. A stage whose tools
+# failed must not be memoized; prefork runs one job per process and CrewAI
+# calls tools from its own threads, so this is process-wide.
+TOOL_ERRORS = []
+
+
+def tool_error(message):
+    TOOL_ERRORS.append(message)
+    return message
+
 
 # =====================================================
 # SCHEMA: Financial Document Input
@@ -39,34 +51,18 @@ class FinancialDocumentTool(BaseTool):
         try:
 
             if not file_path:
-                return "ERROR: file_path missing"
+                return tool_error("ERROR: file_path missing")
 
             if not os.path.exists(file_path):
-                return f"ERROR: File not found: {file_path}"
-
-            reader = PdfReader(file_path)
-
-            text_parts = []
-
-            for page in reader.pages:
-
-                text = page.extract_text()
-
-                if text:
-
-                    # Clean text
-                    text = text.replace("\x00", "")
-
-                    text = re.sub(r"\n{3,}", "\n\n", text)
-
-                    text = re.sub(r"[^\x00-\x7F]+", " ", text)
+                return tool_error(f"ERROR: File not found: {file_path}")
 
-                    text_parts.append(text.strip())
+            # Parsed once per document content, reused across jobs and queries
+            artifact = get_artifact(file_path)
 
-            if not text_parts:
-                return "ERROR: No readable content"
+            full_text = read_text(artifact)
 
-            full_text = "\n".join(text_parts)
+            if not full_text:
+                return tool_error("ERROR: No readable content")
 
             # Hard safety limit for glm-5 cloud
             cleaned_text = full_text[:10000]
@@ -82,7 +78,7 @@ class FinancialDocumentTool(BaseTool):
 
         except Exception as e:
 
-            return f"ERROR reading PDF: {str(e)}"
+            return tool_error(f"ERROR reading PDF: {str(e)}")
 
 
 # =====================================================
@@ -121,13 +117,7 @@ class InvestmentTool(BaseTool):
             data_lower = data.lower()
 
 # accept both checksum content and summaries
-            valid = (
-              "revenue" in data_lower or
-              "income" in data_lower or
-              "cash" in data_lower or
-              "margin" in data_lower or
-              "growth" in data_lower 
-             )
+            valid = any(k in data_lower for k in INVESTMENT_INDICATORS)
 
             if not valid:
                return "Investment Insight:\n- Insufficient financial indicators"
@@ -169,7 +159,7 @@ class InvestmentTool(BaseTool):
 
         except Exception as e:
 
-            return f"Investment tool error: {str(e)}"
+            return tool_error(f"Investment tool error: {str(e)}")
 
 
 # =====================================================
@@ -207,13 +197,7 @@ class RiskTool(BaseTool):
 
             data_lower = data.lower()
 
-            valid = (
-              "revenue" in data_lower or
-              "income" in data_lower or
-              "cash" in data_lower or
-              "risk" in data_lower or
-              "decline" in data_lower
-             )
+            valid = any(k in data_lower for k in RISK_INDICATORS)
 
             if not valid:
               return "Risk Overview:\n- Insufficient risk indicators"
@@ -253,7 +237,7 @@ class RiskTool(BaseTool):
 
         except Exception as e:
 
-            return f"Risk tool error: {str(e)}"
+            return tool_error(f"Risk tool error: {str(e)}")
 
 
 # =====================================================
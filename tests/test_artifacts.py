@@ -0,0 +1,143 @@
+from app.artifacts import detect_period, extract_metrics
+
+
+# Layout of pypdf output for a quarterly shareholder update
+UPDATE_COVER = """Q2 2025 Update
+Highlights
+Total revenue decreased 12% YoY to $22.5B
+Income from operations decreased 42% YoY to $0.9B
+Operating cash flow of $2.5B and free cash flow of $0.1B"""
+
+UPDATE_SUMMARY = """Financial Summary (Unaudited)
+($ in millions, except percentages and per share data) Q2-2024 Q3-2024 Q4-2024 Q1-2025 Q2-2025 QoQ YoY
+Total revenues 25,500 25,182 25,707 19,335 22,496 16% -12%
+Income from operations 1,605 2,717 1,583 399 923 131% -42%
+Operating margin 6.3% 10.8% 6.2% 2.1% 4.1% 204 bp -219 bp
+Net income attributable to common stockholders (GAAP) 1,478 2,167 2,317 409 1,172 187% -16%
+Net cash provided by operating activities 3,612 6,255 4,814 2,156 2,540 18% -30%
+Free cash flow 1,342 2,742 2,034 664 146 -78% -89%
+Cash, cash equivalents & investments 30,720 33,648 36,563 36,996 36,782 -1% 20%"""
+
+
+def test_detect_period_prefers_title():
+    assert detect_period(UPDATE_COVER)["label"] == "Q2 2025"
+
+
+def test_detect_period_from_table_header_takes_latest_column():
+    assert detect_period(UPDATE_SUMMARY)["label"] == "Q2 2025"
+
+
+def test_detect_period_fiscal_year():
+    period = detect_period("Annual Report\nFiscal year 2024\nRevenue grew in fiscal 2023 and 2024")
+
+    assert period == {"label": "FY 2024", "year": 2024, "quarter": None}
+
+
+def test_table_column_matches_reporting_period():
+    pages = [UPDATE_COVER, UPDATE_SUMMARY]
+
+    metrics = extract_metrics(pages, detect_period(UPDATE_COVER))
+
+    assert metrics["revenue"]["value"] == 22496
+    assert metrics["operating_income"]["value"] == 923
+    assert metrics["operating_margin"]["value"] == 4.1
+    assert metrics["net_income"]["value"] == 1172
+    assert metrics["operating_cash_flow"]["value"] == 2540
+    assert metrics["free_cash_flow"]["value"] == 146
+
+    assert metrics["revenue"]["period"] == "Q2 2025"
+    assert metrics["revenue"]["source"] == "table"
+    assert metrics["revenue"]["page"] == 1
+
+
+def test_table_column_for_earlier_period():
+    period = {"label": "Q1 2025", "year": 2025, "quarter": 1}
+
+    metrics = extract_metrics([UPDATE_SUMMARY], period)
+
+    assert metrics["revenue"]["value"] == 19335
+    assert metrics["free_cash_flow"]["value"] == 664
+
+
+def test_percent_changes_are_not_amounts():
+    metrics = extract_metrics([UPDATE_COVER], detect_period(UPDATE_COVER))
+
+    # Only "12%"/"42%" and unit-suffixed figures follow these labels
+    assert "revenue" not in metrics
+    assert "operating_income" not in metrics
+
+
+def test_prose_fallback():
+    text = (
+        "For the year ended December 31, 2024 total revenue was $ 4,812 million.\n"
+        "Gross margin improved 180 basis points to 41.2% on lower input costs.\n"
+        "Net loss was (312) compared with net income of 95 in 2023."
+    )
+
+    metrics = extract_metrics([text])
+
+    assert metrics["revenue"]["value"] == 4812
+    assert metrics["revenue"]["source"] == "prose"
+    assert metrics["gross_margin"]["value"] == 41.2
+    # The current year's loss, not the comparative 2023 income
+    assert metrics["net_income"]["value"] == -312
+
+
+def test_net_loss_in_words_is_negative():
+    metrics = extract_metrics(["The company reported a net loss of $ 48 million for the quarter."])
+
+    assert metrics["net_income"]["value"] == -48
+
+
+def test_qualified_labels_under_a_header_use_the_period_column():
+    text = (
+        "Q2 2025 Update\n"
+        "($ in millions) Q2-2024 Q3-2024 Q4-2024 Q1-2025 Q2-2025\n"
+        "GAAP net income 1,478 2,167 2,317 409 1,172\n"
+        "Total GAAP gross margin 18.0% 19.8% 16.3% 16.3% 17.2%"
+    )
+
+    metrics = extract_metrics([text], detect_period(text))
+
+    assert metrics["net_income"]["value"] == 1172
+    assert metrics["net_income"]["source"] == "table"
+    assert metrics["gross_margin"]["value"] == 17.2
+
+
+def test_prose_fallback_skips_table_rows():
+    text = (
+        "Q2-2024 Q3-2024 Q4-2024 Q1-2025 Q2-2025\n"
+        "Net income reconciliation 1,478 2,167\n"
+    )
+
+    # Too few figures for the header, and the oldest column is no answer either
+    assert "net_income" not in extract_metrics([text], {"label": "Q2 2025", "year": 2025, "quarter": 2})
+
+
+def test_negative_and_empty_cells():
+    text = (
+        "Q3 2024 Q4 2024\n"
+        "Operating income (1,204) (88)\n"
+        "Free cash flow - 310"
+    )
+
+    metrics = extract_metrics([text], {"label": "Q4 2024", "year": 2024, "quarter": 4})
+
+    assert metrics["operating_income"]["value"] == -88
+    assert metrics["free_cash_flow"]["value"] == 310
+
+
+def test_footnote_markers_do_not_shift_columns():
+    text = (
+        "($ in millions) Q2-2024 Q3-2024 Q4-2024 Q1-2025 Q2-2025\n"
+        "Total revenues(1) 25,500 25,182 25,707 19,335 22,496\n"
+        "Net income attributable to common stockholders (GAAP)(2) 1,478 2,167 2,317 409 1,172\n"
+        "Free cash flow* 1,342 2,742 2,034 664 146"
+    )
+
+    metrics = extract_metrics([text], {"label": "Q2 2025", "year": 2025, "quarter": 2})
+
+    assert metrics["revenue"]["value"] == 22496
+    assert metrics["revenue"]["period"] == "Q2 2025"
+    assert metrics["net_income"]["value"] == 1172
+    assert metrics["free_cash_flow"]["value"] == 146
@@ -0,0 +1,113 @@
+import pytest
+
+from app.artifacts import detect_period, extract_metrics
+from app.comparison import build_metrics_table, render_metrics_table
+
+
+Q1_UPDATE = """Q1 2025 Update
+Financial Summary (Unaudited)
+($ in millions) Q1-2024 Q2-2024 Q3-2024 Q4-2024 Q1-2025 QoQ YoY
+Total revenues 21,301 25,500 25,182 25,707 19,335 -25% -9%
+Income from operations 1,171 1,605 2,717 1,583 399 -75% -66%
+Operating margin 5.5% 6.3% 10.8% 6.2% 2.1% -409 bp -343 bp
+Net income attributable to common stockholders (GAAP) 1,129 1,478 2,167 2,317 409 -82% -64%
+Free cash flow (2,531) 1,342 2,742 2,034 664 -67% 126%"""
+
+Q2_UPDATE = """Q2 2025 Update
+Total revenue decreased 12% YoY to $22.5B
+Financial Summary (Unaudited)
+($ in millions) Q2-2024 Q3-2024 Q4-2024 Q1-2025 Q2-2025 QoQ YoY
+Total revenues 25,500 25,182 25,707 19,335 22,496 16% -12%
+Income from operations 1,605 2,717 1,583 399 923 131% -42%
+Operating margin 6.3% 10.8% 6.2% 2.1% 4.1% 204 bp -219 bp
+Net income attributable to common stockholders (GAAP) 1,478 2,167 2,317 409 1,172 187% -16%
+Free cash flow 1,342 2,742 2,034 664 146 -78% -89%"""
+
+
+def artifact(text):
+    period = detect_period(text)
+
+    return {"period": period, "metrics": extract_metrics([text], period)}
+
+
+def test_table_from_two_quarterly_updates():
+    # Uploaded newest first; the table is ordered by period
+    table = build_metrics_table(
+        [artifact(Q2_UPDATE), artifact(Q1_UPDATE)],
+        ["q2.pdf", "q1.pdf"]
+    )
+
+    assert list(table.index) == ["Q1 2025 (q1.pdf)", "Q2 2025 (q2.pdf)"]
+
+    q1, q2 = table.iloc[0], table.iloc[1]
+
+    assert q1["revenue"] == 19335
+    assert q2["revenue"] == 22496
+    assert q2["operating_income"] == 923
+    assert q2["operating_margin"] == 4.1
+    assert q2["net_income"] == 1172
+    assert q2["free_cash_flow"] == 146
+
+    assert q2["revenue_pop"] == pytest.approx(22496 / 19335 - 1)
+    assert q2["free_cash_flow_pop"] == pytest.approx(146 / 664 - 1)
+
+    median = (19335 + 22496) / 2
+    assert q1["revenue_vs_median"] == pytest.approx(19335 / median - 1)
+
+    # Metrics found in neither document are left out
+    assert "total_debt" not in table.columns
+
+    assert "Q2 2025 (q2.pdf)" in render_metrics_table(table)
+
+
+def metrics_artifact(period, **values):
+    return {
+        "period": period,
+        "metrics": {name: {"value": value} for name, value in values.items()},
+    }
+
+
+def quarter(year, number):
+    return {"label": f"Q{number} {year}", "year": year, "quarter": number}
+
+
+def test_non_positive_bases_are_empty():
+    table = build_metrics_table(
+        [
+            metrics_artifact(quarter(2024, 4), net_income=-5.0, free_cash_flow=0.0),
+            metrics_artifact(quarter(2025, 1), net_income=10.0, free_cash_flow=0.0),
+        ],
+        ["q4.pdf", "q1.pdf"]
+    )
+
+    assert table["net_income_pop"].isna().all()
+    assert table["free_cash_flow_vs_median"].isna().all()
+
+    # Median of -5 and 10 is 2.5, still a valid base
+    assert table["net_income_vs_median"].iloc[1] == pytest.approx(10 / 2.5 - 1)
+
+    assert "inf" not in render_metrics_table(table)
+
+
+def test_pop_only_between_dated_distinct_periods():
+    table = build_metrics_table(
+        [
+            metrics_artifact(quarter(2025, 1), revenue=100.0),
+            metrics_artifact(quarter(2025, 1), revenue=300.0),
+            metrics_artifact(None, revenue=50.0),
+            metrics_artifact(quarter(2025, 2), revenue=330.0),
+        ],
+        ["a.pdf", "peer.pdf", "undated.pdf", "a_q2.pdf"]
+    )
+
+    assert list(table.index) == [
+        "Q1 2025 (a.pdf)",
+        "Q1 2025 (peer.pdf)",
+        "Q2 2025 (a_q2.pdf)",
+        "Unknown period (undated.pdf)",
+    ]
+
+    pop = table["revenue_pop"]
+
+    assert pop.isna().tolist() == [True, True, False, True]
+    assert pop.iloc[2] == pytest.approx(330 / 300 - 1)
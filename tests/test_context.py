@@ -0,0 +1,69 @@
+from app.context import template_fields, compact_output, render_context
+
+
+FIELDS = template_fields("""Financial Analysis Report
+Revenue Analysis:
+Cash Flow Analysis:
+Key Insights:
+""")
+
+
+def test_template_fields():
+    assert FIELDS == ["Revenue Analysis", "Cash Flow Analysis", "Key Insights"]
+
+
+def test_colon_headings():
+    summary = compact_output(
+        "Preamble dropped\n"
+        "Revenue Analysis: Revenue fell 12% YoY to $22.5B\n"
+        "- Automotive down 16%\n"
+        "**Key Insights**:\n"
+        "- Margins compressed\n",
+        FIELDS
+    )
+
+    assert summary == {
+        "Revenue Analysis": "Revenue fell 12% YoY to $22.5B; Automotive down 16%",
+        "Key Insights": "Margins compressed",
+    }
+
+
+def test_markdown_and_numbered_headings():
+    summary = compact_output(
+        "## Financial Analysis Report\n"
+        "1. Revenue Analysis:\n"
+        "Total revenues of $22,496M\n"
+        "### Cash Flow Analysis\n"
+        "Free cash flow of $146M\n"
+        "3) **Key Insights**\n"
+        "- Operating margin 4.1%\n",
+        FIELDS
+    )
+
+    assert summary == {
+        "Revenue Analysis": "Total revenues of $22,496M",
+        "Cash Flow Analysis": "Free cash flow of $146M",
+        "Key Insights": "Operating margin 4.1%",
+    }
+
+
+def test_heading_names_inside_prose_are_content():
+    summary = compact_output(
+        "Key Insights:\n"
+        "Revenue analysis shows a decline\n",
+        FIELDS
+    )
+
+    assert summary == {"Key Insights": "Revenue analysis shows a decline"}
+
+
+def test_render_context_budget_and_fallback():
+    text = "Revenue Analysis: " + "growth " * 200 + "\nKey Insights: margins"
+
+    rendered = render_context(text, FIELDS, ["Key Insights", "Revenue Analysis"], budget_tokens=20)
+
+    assert rendered.startswith("Key Insights: margins\nRevenue Analysis: growth")
+    assert len(rendered) <= 20 * 4 + 10
+
+    assert render_context("Free-form answer", FIELDS, ["Key Insights"]) == "Free-form answer"
+    assert render_context("", FIELDS, ["Key Insights"]) == "Not available"